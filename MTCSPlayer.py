@@ -1,6 +1,9 @@
+import time
+import weakref
 import numpy as np
 from operator import itemgetter
-import _pickle as cPickle
+from transposition import TranspositionTable
+from macro import MacroPlan, playable, play_macro, sample_macros
 
 
 task_duration = {
@@ -33,36 +36,66 @@ def policy_value_fn(board):
 class TreeNode(object):
     """A node in the MCTS tree. Each node keeps track of its own value Q,
     prior probability P, and its visit-count-adjusted prior score u.
+    Children are expanded lazily: expand stores the priors of the actions,
+    and the node of an action is only created when it is first selected.
     """
+    # number of nodes created in this process, see instrument.SearchStats
+    created = 0
 
     def __init__(self, parent, prior_p):
+        TreeNode.created += 1
         self.parent = parent
         self.children = {}  # a map from action to TreeNode
+        self.priors = {}  # a map from every expanded action to its prior
+        self.child_type = TreeNode
         self.n_visits = 0
         self.Q = 0
         self.u = 0
         self.P = prior_p
+        # hash of the state this node stands for, if in a transposition table
+        self.key = None
+        # lower bound on the makespan below this node, see MCTS bounds
+        self.bound = 0
 
-    def expand(self, action_priors):
-        """Expand tree by creating new children.
+    def expand(self, action_priors, node_type=None):
+        """Expand tree by adding the actions as children, created by child.
         action_priors: a list of tuples of actions and their prior probability
             according to the policy function.
+        node_type: the class of the children, TreeNode by default.
         """
+        self.child_type = node_type or TreeNode
         for action, prob in action_priors:
-            if action not in self.children:
-                self.children[action] = TreeNode(self, prob)
+            if action not in self.priors:
+                self.priors[action] = prob
+
+    def child(self, action):
+        """Return the node of action, creating it on its first selection."""
+        node = self.children.get(action)
+        if node is None:
+            node = self.children[action] = self.child_type(self, self.priors[action])
+        return node
 
     def select(self, c_puct):
-        """Select action among children that gives maximum action value Q
-        plus bonus u(P).
-        Return: A tuple of (action, next_node)
+        """Return a map from every action to [Q plus bonus u(P), its node],
+        in the order of expansion. The node is None for an action that has
+        no node yet; its value is that of an unvisited node.
         """
         data = {}
-        for k, v in self.children.items():
-            data[k] = [v.get_value(c_puct), v]
+        bonus = np.sqrt(self.n_visits)
+        for action, prob in self.priors.items():
+            node = self.children.get(action)
+            if node is None:
+                data[action] = [c_puct * prob * bonus, None]
+            else:
+                data[action] = [node.get_value(c_puct, self.n_visits), node]
         return data
         # return max(self.children.items(), key=lambda act_node: act_node[1].get_value(c_puct))
 
+    def expanded(self):
+        """The (action, node) of the children with a node, in the order of
+        expansion."""
+        return [(action, self.children[action]) for action in self.priors if action in self.children]
+
     def update(self, leaf_value):
         """Update node values from leaf evaluation.
         leaf_value: the value of subtree evaluation from the current player's
@@ -81,29 +114,64 @@ class TreeNode(object):
             self.parent.update_recursive(leaf_value)
         self.update(leaf_value)
 
-    def get_value(self, c_puct):
+    def get_value(self, c_puct, parent_visits=None):
         """Calculate and return the value for this node.
         It is a combination of leaf evaluations Q, and this node's prior
         adjusted for its visit count, u.
         c_puct: a number in (0, inf) controlling the relative impact of
             value Q, and prior probability P, on this node's score.
+        parent_visits: visit count of the node selecting this one, which
+            with a transposition table need not be self.parent.
         """
-        self.u = (c_puct * self.P * np.sqrt(self.parent.n_visits) / (1 + self.n_visits))
+        if parent_visits is None:
+            parent_visits = self.parent.n_visits
+        self.u = (c_puct * self.P * np.sqrt(parent_visits) / (1 + self.n_visits))
         return self.Q + self.u
 
     def is_leaf(self):
         """Check if leaf node (i.e. no nodes below this have been expanded).
         """
-        return self.children == {}
+        return not self.priors
 
     def is_root(self):
         return self.parent is None
 
 
+class ChanceNode(TreeNode):
+    """The node of an action whose resulting state also depends on a random
+    draw, the player of the next move. Its value is the average over the
+    draws, each of which leads to its own decision node in outcomes.
+    """
+
+    def __init__(self, parent, prior_p):
+        super(ChanceNode, self).__init__(parent, prior_p)
+        self.outcomes = {}  # a map from the drawn player id to TreeNode
+
+    def outcome(self, player_id):
+        """Return the decision node following the draw of player_id."""
+        if player_id not in self.outcomes:
+            self.outcomes[player_id] = TreeNode(self, 1.0)
+        return self.outcomes[player_id]
+
+
+# every search tree of this process, see MCTS process_node_budget
+_searches = weakref.WeakSet()
+
+
+def process_nodes():
+    """The number of nodes of all search trees of this process."""
+    return sum(mcts.size or 0 for mcts in list(_searches))
+
+
 class MCTS(object):
     """A simple implementation of Monte Carlo Tree Search."""
+    # the most nodes all trees of this process held at the end of a playout
+    # or search, see process_nodes
+    process_peak = 0
 
-    def __init__(self, policy_value_fn, c_puct=5, n_playout=10000):
+    def __init__(self, policy_value_fn, c_puct=5, n_playout=10000, n_rollout=1, rollout_stat='mean', tt_size=0,
+                 time_budget=0, early_stop=False, rollout_policy='random', epsilon=0.1, bounds=False,
+                 node_budget=0, process_node_budget=0, symmetry=False, macro=0):
         """
         policy_value_fn: a function that takes in a board state and outputs
             a list of (action, probability) tuples and also a score in [-1, 1]
@@ -112,122 +180,648 @@ class MCTS(object):
         c_puct: a number in (0, inf) that controls how quickly exploration
             converges to the maximum-value policy. A higher value means
             relying on the prior more.
+        n_rollout: number of rollouts per leaf. More than one runs them as a
+            batch in NumPy (see batch_rollout.BatchRollout).
+        rollout_stat: statistic of the batched makespans that is backed up,
+            'mean' or 'min'.
+        tt_size: if > 0, equivalent states share one node through a
+            transposition table of at most this many entries, which turns
+            the tree into a DAG.
+        time_budget: if > 0, the seconds a move may search at most, on top
+            of the n_playout budget.
+        early_stop: stop searching a move once the remaining budget can no
+            longer change the most visited root action.
+        rollout_policy: how rollouts pick tasks, see
+            rollout_policy.RolloutPolicy; epsilon is the random share of
+            the 'epsilon' policy.
+        bounds: branch and bound with bounds.LowerBound: children whose
+            lower bound exceeds the best makespan found in this search are
+            no longer selected, and rollouts stop once their bound reaches
+            it. The counts are kept in pruned and cutoffs.
+        node_budget: if > 0, the most nodes the tree may hold. Once a playout
+            takes it over, the least visited subtrees are collapsed until
+            half of it is left, see _prune.
+        process_node_budget: if > 0, the most nodes all trees of this
+            process may hold together; a search over it prunes its own tree
+            once it grew by an eighth of the budget since it was last pruned.
+            Both count the nodes in the tree: nodes only a transposition
+            table still holds are freed once the table evicts them. Trees
+            are only counted with either budget set.
+        symmetry: expand only one of the ready tasks that can be swapped
+            without changing the game, see symmetry.TaskSymmetry; it gets
+            the sum of their priors.
+        macro: if > 0, an edge of the tree assigns tasks to all agents idle
+            at the next decision time at once. Expansion samples this many
+            joint assignments with the rollout policy, each with the share
+            of the samples as prior; see macro.py. get_move still returns
+            one task, and the rest of the chosen assignment on the next
+            calls at the same decision time.
         """
         self.root = TreeNode(None, 1.0)
         self.policy = policy_value_fn
         self.c_puct = c_puct
         self.n_playout = n_playout
+        self.n_rollout = n_rollout
+        self.rollout_stat = rollout_stat
+        self.batch_rollout = None
+        self.rollout_policy = rollout_policy
+        self.epsilon = epsilon
+        self.rollout = None
+        self.bounds = bounds
+        self.lower_bound = None
+        self.incumbent = float('inf')
+        self.pruned = 0
+        self.cutoffs = 0
+        self.table = TranspositionTable(tt_size) if tt_size > 0 else None
+        self.time_budget = time_budget
+        self.early_stop = early_stop
+        self.node_budget = node_budget
+        self.process_node_budget = process_node_budget
+        self.symmetry = symmetry
+        self.task_symmetry = None
+        self.macro = macro
+        # the rest of the joint assignment chosen last, and the moves played
+        # since the root's state, see update_with_move
+        self.plan = MacroPlan()
+        self.played = []
+        # nodes in the tree now, None without a node budget, and at most,
+        # nodes removed by _prune and the size after the last one
+        self.size = 1 if node_budget or process_node_budget else None
+        self.peak_size = 1
+        self.collapsed = 0
+        self.pruned_size = 0
+        _searches.add(self)
+        # per phase timers and counters, see instrument.SearchStats
+        self.stats = None
+        # playouts run for the last move and for all moves so far
+        self.last_playouts = 0
+        self.total_playouts = 0
 
     def _playout(self, state):
         """Run a single playout from the root to the leaf, getting a value at
         the leaf and propagating it back through its parents.
         State is modified in-place, so a copy must be provided.
         """
+        stats = self.stats
+        macro = self.macro
+        created = TreeNode.created
         node = self.root
+        path = [node]
         while(1):
             if node.is_leaf():
                 break
             # Greedily select next move.
+            parent = node
             data = node.select(self.c_puct)
+            if self.bounds:
+                data = {action: item for action, item in data.items()
+                        if item[1] is None or item[1].bound <= self.incumbent} or data
             data = sorted(data.items(), key=lambda kv: kv[1][0])
+            if stats is not None:
+                # the children popped below are each tested against availables
+                stats.counts['scans'] += len(data)
 
             while data:
                 action, (r, node) = data.pop()
-                if action in state.availables:
+                if playable(state, action) is not None if macro else action in state.availables:
+                    if stats is not None:
+                        stats.counts['scans'] -= len(data)
                     break
                 else:
-                    action = state.availables[0]
-                    if action in self.root.children.keys():
-                        node = self.root.children[action]
+                    first = next(iter(state.availables))
+                    action = (first,) if macro else first
+                    if action in self.root.priors:
+                        node = self.root.child(action)
                     else:
                         node = TreeNode(self.root, 1/(len(self.root.children)+1))
-
-            state.do_move(action)
-        action_probs, _ = self.policy(state)
+            if node is None:
+                node = parent.child(action)
+
+            if macro:
+                play_macro(state, action)
+            else:
+                state.do_move(action)
+            bound = self._bound(state) if self.bounds else 0
+            if isinstance(node, ChanceNode):
+                node.bound = bound
+                path.append(node)
+                chance = node
+                node = chance.outcome(state.current_player.id)
+                if self.table is not None and node.key is None:
+                    node = self.table.lookup(state.state_hash(), node)
+                    chance.outcomes[state.current_player.id] = node
+            elif self.table is not None:
+                node = self._transpose(state, parent, action, node)
+            path.append(node)
+            node.bound = bound
+            if bound > self.incumbent:
+                # no completion of this state can match the best one found
+                self.pruned += 1
+                for node in path:
+                    node.update(-bound)
+                if self.size is not None:
+                    self.size += TreeNode.created - created
+                if stats is not None:
+                    stats.lap('select')
+                    stats.playout(len(path) - 1, TreeNode.created - created)
+                return
+        if stats is not None:
+            stats.lap('select')
         # Check for end of game
         end, used_time = state.game_end()
-        if not end:
-            node.expand(action_probs)
+        if stats is not None:
+            stats.lap('game_end')
+        if not end and macro:
+            node.expand(sample_macros(state, self._rollout_move, macro),
+                        ChanceNode if state.random_next_player else TreeNode)
+        elif not end:
+            action_probs, _ = self.policy(state)
+            if self.symmetry:
+                action_probs = self._symmetry(state).reduce(state, action_probs)
+            # model the random draw of the next player with chance nodes
+            node.expand(action_probs, ChanceNode if state.random_next_player else TreeNode)
+        if stats is not None:
+            stats.lap('expand')
+            assigned = state.assigned
         # Evaluate the leaf node by random rollout
         leaf_value = self._evaluate_rollout(state)
+        if stats is not None:
+            stats.lap('rollout')
+            stats.counts['rollout_moves'] += bin(state.assigned & ~assigned).count('1')
         # Update value and visit count of nodes in this traversal.
-        node.update_recursive(-leaf_value)
+        for node in path:
+            node.update(-leaf_value)
+        if self.size is not None:
+            self.size += TreeNode.created - created
+        if stats is not None:
+            stats.lap('backup')
+            stats.playout(len(path) - 1, TreeNode.created - created)
+
+    def _transpose(self, state, parent, action, node):
+        """Return the node shared by all states equivalent to state, which
+        was reached from parent by action and selected node."""
+        key = state.state_hash()
+        if node.key == key:
+            return node
+        is_child = parent.children.get(action) is node
+        if node.key is not None or not is_child:
+            # node stands for another state: a different draw of the next
+            # player, or the fallback when the action was not available
+            node = TreeNode(parent, node.P)
+        node = self.table.lookup(key, node)
+        if is_child:
+            parent.children[action] = node
+        return node
+
+    def _bound(self, state, incumbent=None):
+        if self.lower_bound is None:
+            from bounds import LowerBound
+            self.lower_bound = LowerBound(state.current_game_state)
+        return self.lower_bound(state, incumbent)
+
+    def _symmetry(self, state):
+        if self.task_symmetry is None:
+            from symmetry import task_symmetry
+            self.task_symmetry = task_symmetry(state.current_game_state)
+        return self.task_symmetry
 
     def _evaluate_rollout(self, state, limit=1000):
         """Use the rollout policy to play until the end of the game,
-        returning used_time.
+        returning used_time. With bounds, a rollout that can no longer beat
+        the best makespan found returns its lower bound instead.
         """
+        if self.n_rollout > 1:
+            if self.batch_rollout is None:
+                from batch_rollout import BatchRollout
+                self.batch_rollout = BatchRollout(state.current_game_state, self.n_rollout, self.rollout_stat,
+                                                  policy=self.rollout_policy, epsilon=self.epsilon)
+            if not self.bounds:
+                return self.batch_rollout.evaluate(state)
+            from batch_rollout import summarize
+            stats = summarize(self.batch_rollout.simulate(state))
+            self.incumbent = min(self.incumbent, stats['min'])
+            return stats[self.rollout_stat]
+        checked = None
         for i in range(limit):
             end, used_time = state.game_end()
             if end:
+                if self.bounds:
+                    self.incumbent = min(self.incumbent, used_time)
                 break
-            action_probs = rollout_policy_fn(state)
-            max_action = max(action_probs, key=itemgetter(1))[0]
-            # print(max_action)
-            state.do_move(max_action)
+            # assigning tasks does not change the bound, only time does
+            if self.bounds and self.incumbent < float('inf') and state.counter != checked:
+                checked = state.counter
+                bound = self._bound(state, self.incumbent)
+                if bound >= self.incumbent:
+                    self.cutoffs += 1
+                    return bound
+            state.do_move(self._rollout_move(state))
         else:
             # If no break from the loop, issue a warning.
             print("WARNING: rollout reached move limit")
         return used_time
 
-    def get_move(self, state):
-        """Runs all playouts sequentially and returns the most visited action.
+    def _rollout_move(self, state):
+        """The task the rollout policy picks on state."""
+        if self.rollout is None and self.rollout_policy != 'random':
+            from rollout_policy import RolloutPolicy
+            self.rollout = RolloutPolicy(state.current_game_state, self.rollout_policy, self.epsilon)
+        if self.rollout is not None:
+            return self.rollout.choose(state)
+        action_probs = rollout_policy_fn(state)
+        return max(action_probs, key=itemgetter(1))[0]
+
+    def _set_root(self, state):
+        """Make the root stand for state."""
+        key = state.state_hash()
+        if self.root.key is not None and self.root.key != key:
+            # the tree was not advanced with the moves played since
+            self.root = TreeNode(None, 1.0)
+            self._count()
+            self.played = []
+        if self.table is not None:
+            self.root = self.table.lookup(key, self.root)
+            self._count()
+        else:
+            self.root.key = key
+
+    def _root_visits(self):
+        children = self.root.children
+        return [children[action].n_visits if action in children else 0 for action in self.root.priors]
+
+    def _decided(self, remaining):
+        """Whether remaining more playouts cannot change the most visited
+        root action. Never before a root action has a node."""
+        if not self.root.children:
+            return False
+        visits = sorted(self._root_visits())
+        if len(visits) < 2:
+            return len(visits) == 1
+        return visits[-1] - visits[-2] > remaining
+
+    def search(self, state, n_playout=None, time_budget=None):
+        """Runs playouts sequentially from state until the playout or the
+        time budget is spent, or with early_stop until the move is decided.
+        n_playout, time_budget: override the budgets of this search.
+
+        Return: the number of playouts run
+        """
+        n_playout = self.n_playout if n_playout is None else n_playout
+        time_budget = self.time_budget if time_budget is None else time_budget
+        root_state = state.clone()
+        self._set_root(root_state)
+        # bounds only prune against completions of this root
+        self.incumbent = float('inf')
+        stats = self.stats
+        if stats is not None:
+            clone_bytes = root_state.clone_bytes()
+        start = time.perf_counter()
+        n = 0
+        while n < n_playout:
+            if stats is None:
+                self._playout(root_state.clone())
+            else:
+                stats.start()
+                state = root_state.clone()
+                stats.lap('clone')
+                stats.counts['clones'] += 1
+                stats.counts['clone_bytes'] += clone_bytes
+                self._playout(state)
+            n += 1
+            if self.node_budget or self.process_node_budget:
+                self._check_budget()
+            if time_budget or self.early_stop:
+                elapsed = time.perf_counter() - start
+                if time_budget and elapsed >= time_budget:
+                    break
+                if self.early_stop:
+                    remaining = n_playout - n
+                    if time_budget:
+                        # the playouts that fit in the time left at the current rate
+                        remaining = min(remaining, n * (time_budget - elapsed) / elapsed)
+                    if self._decided(remaining):
+                        break
+        self.last_playouts = n
+        self.total_playouts += n
+        if self.size is not None:
+            if self.table is not None:
+                # nodes replaced by shared ones were counted when created
+                self._count()
+            self.peak_size = max(self.peak_size, self.size)
+            MCTS.process_peak = max(MCTS.process_peak, process_nodes())
+        return n
+
+    def _count(self):
+        """Count the nodes of the tree again, if it is counted."""
+        if self.size is not None:
+            self.size = self._kept(-1)
+            self.pruned_size = min(self.pruned_size, self.size)
+
+    def _check_budget(self):
+        """Prune the tree if it is over node_budget, or if all trees of the
+        process are over process_node_budget and this one grew by an eighth
+        of it since it was last pruned, so that a tree the others leave no
+        room does not prune itself on every playout."""
+        if self.node_budget and self.size > self.node_budget:
+            self.peak_size = max(self.peak_size, self.size)
+            MCTS.process_peak = max(MCTS.process_peak, process_nodes())
+            self._prune(self.node_budget // 2)
+        if self.process_node_budget and self.size - self.pruned_size >= max(1, self.process_node_budget // 8):
+            total = process_nodes()
+            MCTS.process_peak = max(MCTS.process_peak, total)
+            if total > self.process_node_budget:
+                self.peak_size = max(self.peak_size, self.size)
+                # free the excess and half of the budget from this tree
+                self._prune(max(1, self.size - (total - self.process_node_budget // 2)))
+
+    def _prune(self, target):
+        """Collapse the subtrees below the least visited nodes, those with
+        at most some number of visits, choosing the smallest number that
+        leaves at most target nodes (or else just the root and its
+        children). A collapsed node keeps its statistics and, for a
+        decision node, its priors; its children are created again once it
+        is selected.
+        """
+        visits = self._visit_counts()
+        low, high = 0, len(visits) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._kept(visits[middle]) <= target:
+                high = middle
+            else:
+                low = middle + 1
+        size = self.size
+        self._collapse(visits[low] if visits else -1)
+        self.collapsed += size - self.size
+        self.pruned_size = self.size
+
+    def _below(self, node):
+        if isinstance(node, ChanceNode):
+            return list(node.outcomes.values())
+        return list(node.children.values())
+
+    def _walk(self, threshold, collapse=False):
+        """Count the nodes of the tree that are kept when the nodes other
+        than the root with at most threshold visits lose their subtrees,
+        and with collapse remove those subtrees."""
+        seen = set() if self.table is not None else None
+        count = 1
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for child in self._below(node):
+                if seen is not None:
+                    if id(child) in seen:
+                        continue
+                    seen.add(id(child))
+                count += 1
+                if child.n_visits > threshold:
+                    stack.append(child)
+                elif collapse:
+                    child.children = {}
+                    if isinstance(child, ChanceNode):
+                        child.outcomes = {}
+        return count
+
+    def _kept(self, threshold):
+        return self._walk(threshold)
+
+    def _collapse(self, threshold):
+        self.size = self._walk(threshold, collapse=True)
+
+    def _visit_counts(self):
+        """The distinct visit counts of the nodes below the root, ascending."""
+        seen = set() if self.table is not None else None
+        visits = set()
+        stack = [self.root]
+        while stack:
+            for child in self._below(stack.pop()):
+                if seen is not None:
+                    if id(child) in seen:
+                        continue
+                    seen.add(id(child))
+                visits.add(child.n_visits)
+                stack.append(child)
+        return sorted(visits)
+
+    def root_stats(self):
+        """Return a map from each root action to its (n_visits, Q); actions
+        without a node yet have (0, 0.0)."""
+        children = self.root.children
+        return {action: (children[action].n_visits, children[action].Q) if action in children else (0, 0.0)
+                for action in self.root.priors}
+
+    def _best_move(self):
+        """The most visited root action. After a single playout the root
+        has its priors but no child nodes yet, then the one with the highest
+        prior."""
+        priors = self.root.priors
+        visits = self._root_visits()
+        if not any(visits):
+            return max(priors, key=priors.get)
+        return list(priors)[int(np.argmax(visits))]
+
+    def _ranked_actions(self):
+        """The root actions, the one _best_move picks first and the others
+        by visits."""
+        best = self._best_move()
+        stats = self.root_stats()
+        return [best] + sorted((action for action in stats if action != best), key=lambda action: -stats[action][0])
+
+    def get_move(self, state, n_playout=None, time_budget=None):
+        """Runs the playouts of a move and returns the most visited action.
+        A single available action, or with symmetry a single one that
+        cannot be swapped with the others, is returned without searching,
+        and with macro the next task of the joint assignment chosen for
+        this decision time.
         state: the current game state
+        n_playout, time_budget: override the budgets of this move.
 
         Return: the selected action
         """
-        for n in range(self.n_playout):
-            # state_copy = copy.deepcopy(state)
-            state_copy = cPickle.loads(cPickle.dumps(state))
-            self._playout(state_copy)
-        return max(self.root.children.items(), key=lambda act_node: act_node[1].n_visits)[0]
-
-    def update_with_move(self, last_move):
+        if self.macro:
+            move = self.plan.next(state)
+            if move is not None:
+                self.last_playouts = 0
+                return move
+        moves = state.availables
+        if self.symmetry and len(moves) > 1:
+            moves = self._symmetry(state).firsts(state, moves)
+        if len(moves) == 1:
+            self.last_playouts = 0
+            return next(iter(moves))
+        self.search(state, n_playout, time_budget)
+        if self.macro:
+            # the best joint assignment the player to move has a task in
+            return self.plan.start_best(state, self._ranked_actions()) or self._rollout_move(state)
+        return self._best_move()
+
+    def update_with_move(self, last_move, next_player=None):
         """Step forward in the tree, keeping everything we already know
-        about the subtree.
+        about the subtree. With macro the tree only steps forward once the
+        moves played since its root make up one of its joint assignments.
+        next_player: id of the player drawn to move next, needed to descend
+            through a chance node.
         """
-        if last_move in self.root.children:
-            self.root = self.root.children[last_move]
+        if self.macro:
+            self.played.append(last_move)
+            played = set(self.played)
+            if any(played <= set(macro) for macro in self.root.priors):
+                last_move = tuple(sorted(self.played))
+                if last_move not in self.root.priors:
+                    return
+            # a joint assignment of the root was played, or none can be
+            self.played = []
+        node = self.root.children.get(last_move)
+        if isinstance(node, ChanceNode):
+            node = node.outcomes.get(next_player)
+        if node is not None:
+            self.root = node
             self.root.parent = None
         else:
             self.root = TreeNode(None, 1.0)
+        self._count()
 
     def __str__(self):
         return "MCTS"
 
 
-class MTCSPlayer:
-    """AI player based on MCTS"""
-    def __init__(self, player_id, agent_type, c_puct=50, n_playout=1000):
+def make_mcts(policy_value_fn, c_puct=5, n_playout=10000, tree='object', **search_options):
+    """Build the search of a player.
+    tree: 'object' for a tree of TreeNode objects, 'array' for the NumPy
+        arrays of array_tree.ArrayMCTS.
+    """
+    if tree == 'array':
+        from array_tree import ArrayMCTS
+        return ArrayMCTS(policy_value_fn, c_puct, n_playout, **search_options)
+    return MCTS(policy_value_fn, c_puct, n_playout, **search_options)
+
+
+class AgentState(object):
+    """The part of a player that a playout mutates: the task it is working
+    on, None when idle, and the time that task finishes."""
+    def __init__(self, player_id, agent_type):
         self.task = None
         # self.active = None
-        self.duration = 0
-        self.mcts = MCTS(policy_value_fn, c_puct, n_playout)
+        self.finish = 0
+        # zobrist key of the running task, see Board.start_task
+        self.key = 0
         self.id = player_id
         self.type = agent_type
 
+    def clone(self):
+        agent = AgentState(self.id, self.type)
+        agent.task = self.task
+        agent.finish = self.finish
+        agent.key = self.key
+        return agent
+
     def set_availability(self, active):
         self.active = active
 
-    def assign_task(self, task, duration):
+    def assign_task(self, task, finish):
         self.set_availability(False)
-        self.duration = duration
+        self.finish = finish
         self.task = task
 
+
+class MTCSPlayer(AgentState):
+    """AI player based on MCTS"""
+    def __init__(self, player_id, agent_type, c_puct=50, n_playout=1000, pool=None, **search_options):
+        """pool: a parallel_search.SearchPool to spread the playouts of
+        every move over, or None to search in this process."""
+        super(MTCSPlayer, self).__init__(player_id, agent_type)
+        if pool is None:
+            self.mcts = make_mcts(policy_value_fn, c_puct, n_playout, **search_options)
+        else:
+            self.mcts = pool.mcts(c_puct, n_playout, **search_options)
+
     def reset_player(self):
         self.mcts.update_with_move(-1)
 
     def get_action(self, board):
+        """Return the move of this player. The search tree is kept: once the
+        move is played, advance it with mcts.update_with_move."""
         sensible_moves = board.availables
         if len(sensible_moves) > 0:
             move = self.mcts.get_move(board)
-            self.mcts.update_with_move(-1)
             return move
         else:
             print("WARNING: all the stones are taken")
 
-    def work(self):
-        self.duration -= 1
 
-    def work_step(self, step):
-        self.duration -= step
+def add_search_args(parser):
+    """Add the MCTS options shared by both game scripts to parser."""
+    parser.add_argument('--rollouts', default=1, type=int, help='Number of rollouts per leaf, run as one NumPy batch if > 1')
+    parser.add_argument('--rollout_stat', default='mean', choices=['mean', 'min'], help='Statistic of the batched rollouts that is backed up')
+    parser.add_argument('--tt_size', default=0, type=int, help='Entries of the transposition table shared by equivalent states, 0 disables it')
+    parser.add_argument('--rollout_policy', default='random', choices=['random', 'critical_path', 'successors', 'epsilon'],
+                        help='Task choice of the rollouts: at random, longest path to the end or most successors first, or critical path with epsilon random moves')
+    parser.add_argument('--epsilon', default=0.1, type=float, help='Share of random moves of the epsilon rollout policy')
+    parser.add_argument('--bounds', action='store_true', help='Prune children and cut rollouts by makespan lower bounds')
+    parser.add_argument('--time_budget', default=0, type=float, help='Seconds a move may search at most, 0 for no limit')
+    parser.add_argument('--early_stop', action='store_true', help='Stop searching once the most visited move cannot change')
+    parser.add_argument('--tree', default='object', choices=['object', 'array'], help='Search tree of TreeNode objects or of NumPy arrays')
+    parser.add_argument('--node_budget', default=0, type=int, help='Most nodes per search tree, the least visited subtrees are collapsed beyond it; 0 for no limit')
+    parser.add_argument('--process_node_budget', default=0, type=int, help='Most nodes of all search trees of a process together; 0 for no limit')
+    parser.add_argument('--symmetry', action='store_true', help='Search only one of the ready tasks that can be swapped without changing the game')
+    parser.add_argument('--macro', default=0, type=int, help='Branch on joint assignments of all idle agents, sampling this many per expansion; 0 branches on single tasks')
+    parser.add_argument('--workers', default=1, type=int, help='Number of processes the playouts of each move are split over')
+
+
+def search_options(args):
+    """Return the MCTS keyword arguments selected by add_search_args."""
+    return {'n_rollout': args.rollouts,
+            'rollout_stat': args.rollout_stat,
+            'tt_size': args.tt_size,
+            'rollout_policy': args.rollout_policy,
+            'epsilon': args.epsilon,
+            'bounds': args.bounds,
+            'time_budget': args.time_budget,
+            'early_stop': args.early_stop,
+            'node_budget': args.node_budget,
+            'process_node_budget': args.process_node_budget,
+            'symmetry': args.symmetry,
+            'macro': args.macro,
+            'tree': args.tree}
+
+
+def bound_stats(players):
+    """Sum the branch and bound counters of the players' searches.
+    Return: None if no player uses bounds
+    """
+    searches = [player.mcts for player in players if getattr(player.mcts, 'bounds', False)]
+    if not searches:
+        return None
+    return {'pruned': sum(mcts.pruned for mcts in searches),
+            'cutoffs': sum(mcts.cutoffs for mcts in searches)}
+
+
+def node_stats(players):
+    """Sum the tree sizes of the players' searches: the nodes they hold
+    now, the most one of them held, the most all trees of the process held
+    and the nodes removed by pruning.
+    Return: None if no player searches in this process with counted trees
+    """
+    searches = [player.mcts for player in players if getattr(player.mcts, 'size', None) is not None]
+    if not searches:
+        return None
+    return {'current': sum(mcts.size for mcts in searches),
+            'peak': max(mcts.peak_size for mcts in searches),
+            'process_peak': MCTS.process_peak,
+            'collapsed': sum(mcts.collapsed for mcts in searches)}
+
+
+def table_stats(players):
+    """Sum the transposition table counters of the players' searches.
+    Return: None if no player uses a table
+    """
+    tables = [player.mcts.table for player in players if getattr(player.mcts, 'table', None) is not None]
+    if not tables:
+        return None
+    stats = {'hits': sum(table.hits for table in tables),
+             'misses': sum(table.misses for table in tables),
+             'evictions': sum(table.evictions for table in tables)}
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,271 @@
+import numpy as np
+from MTCSPlayer import MCTS
+
+
+DECISION, CHANCE = 0, 1
+NO_NODE = -1
+
+
+class ArrayMCTS(MCTS):
+    """MCTS over a tree stored as a struct of NumPy arrays instead of
+    TreeNode objects.
+
+    Node i has visits[i], Q[i], P[i], parent[i], kind[i] and the lower
+    bound bound[i] (see MCTS bounds); the children of
+    a decision node are the contiguous nodes first[i]:first[i] + count[i],
+    allocated together when it is expanded, so PUCT selection is one
+    vectorized argmax over that slice. The action leading to each node is
+    kept in the actions list. The outcomes of a chance node (see
+    MTCSPlayer.ChanceNode) are found in outcomes[node], a map from the
+    drawn player id to the node. Arrays grow by doubling, and the subtree
+    kept by update_with_move is compacted to the front.
+    """
+
+    def __init__(self, policy_value_fn, c_puct=5, n_playout=10000, tt_size=0, capacity=1024, **search_options):
+        if tt_size > 0:
+            raise ValueError('the array tree does not support a transposition table')
+        if search_options.get('macro'):
+            raise ValueError('the array tree does not support macro moves')
+        super(ArrayMCTS, self).__init__(policy_value_fn, c_puct, n_playout, **search_options)
+        self._allocate(capacity)
+        self.root = self._new_nodes(1, NO_NODE, [None], [1.0], DECISION)
+        self.root_key = None
+
+    def _allocate(self, capacity):
+        self.size = 0
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.Q = np.zeros(capacity)
+        self.P = np.zeros(capacity)
+        self.parent = np.full(capacity, NO_NODE, dtype=np.int64)
+        self.first = np.zeros(capacity, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.bound = np.zeros(capacity)
+        self.actions = []
+        self.outcomes = {}
+
+    def _grow(self, needed):
+        capacity = len(self.visits)
+        while capacity < needed:
+            capacity *= 2
+        for name in ('visits', 'Q', 'P', 'parent', 'first', 'count', 'kind', 'bound'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _new_nodes(self, n, parent, actions, priors, kind):
+        """Allocate n contiguous nodes and return the index of the first."""
+        start = self.size
+        if start + n > len(self.visits):
+            self._grow(start + n)
+        end = start + n
+        self.visits[start:end] = 0
+        self.Q[start:end] = 0
+        self.P[start:end] = priors
+        self.parent[start:end] = parent
+        self.first[start:end] = 0
+        self.count[start:end] = 0
+        self.kind[start:end] = kind
+        self.bound[start:end] = 0
+        self.actions.extend(actions)
+        self.size = end
+        return start
+
+    def _expand(self, node, action_priors, kind):
+        actions, priors = zip(*action_priors)
+        self.first[node] = self._new_nodes(len(actions), node, actions, priors, kind)
+        self.count[node] = len(actions)
+
+    def _select(self, node, availables):
+        """Return the available child of node with the highest Q plus bonus
+        u(P), or None if no child is available."""
+        start = self.first[node]
+        end = start + self.count[node]
+        value = self.Q[start:end] + self.c_puct * self.P[start:end] * np.sqrt(self.visits[node]) / (1 + self.visits[start:end])
+        if self.bounds:
+            pruned = self.bound[start:end] > self.incumbent
+            if not pruned.all():
+                value[pruned] = -np.inf
+        # ties go to the last child, like the sorted selection of TreeNode
+        child = end - 1 - int(np.argmax(value[::-1]))
+        if self.stats is not None:
+            self.stats.counts['scans'] += 1
+        if self.actions[child] in availables:
+            return child
+        # without chance nodes the children need not match the state
+        for k in np.argsort(value, kind='stable')[::-1]:
+            if self.stats is not None:
+                self.stats.counts['scans'] += 1
+            if self.actions[start + k] in availables:
+                return start + int(k)
+        return None
+
+    def _outcome(self, chance, player_id):
+        outcomes = self.outcomes.setdefault(chance, {})
+        if player_id not in outcomes:
+            outcomes[player_id] = self._new_nodes(1, chance, [player_id], [1.0], DECISION)
+        return outcomes[player_id]
+
+    def _playout(self, state):
+        stats = self.stats
+        size = self.size
+        node = self.root
+        path = [node]
+        expand = True
+        while self.count[node]:
+            child = self._select(node, state.availables)
+            if child is None:
+                state.do_move(next(iter(state.availables)))
+                expand = False
+                break
+            state.do_move(self.actions[child])
+            node = child
+            path.append(node)
+            if self.kind[node] == CHANCE:
+                node = self._outcome(node, state.current_player.id)
+                path.append(node)
+            if self.bounds:
+                bound = self._bound(state)
+                self.bound[child] = self.bound[node] = bound
+                if bound > self.incumbent:
+                    self.pruned += 1
+                    self._backup(path, bound)
+                    if stats is not None:
+                        stats.lap('select')
+                        stats.playout(len(path) - 1, self.size - size)
+                    return
+        if stats is not None:
+            stats.lap('select')
+        end, used_time = state.game_end()
+        if stats is not None:
+            stats.lap('game_end')
+        if expand and not end:
+            action_probs, _ = self.policy(state)
+            if self.symmetry:
+                action_probs = self._symmetry(state).reduce(state, action_probs)
+            self._expand(node, action_probs, CHANCE if state.random_next_player else DECISION)
+        if stats is not None:
+            stats.lap('expand')
+            assigned = state.assigned
+        leaf_value = self._evaluate_rollout(state)
+        if stats is not None:
+            stats.lap('rollout')
+            stats.counts['rollout_moves'] += bin(state.assigned & ~assigned).count('1')
+        self._backup(path, leaf_value)
+        if stats is not None:
+            stats.lap('backup')
+            stats.playout(len(path) - 1, self.size - size)
+
+    def _backup(self, path, leaf_value):
+        path = np.array(path)
+        self.visits[path] += 1
+        self.Q[path] += (-leaf_value - self.Q[path]) / self.visits[path]
+
+    def _set_root(self, state):
+        key = state.state_hash()
+        if self.root_key is not None and self.root_key != key:
+            # the tree was not advanced with the moves played since
+            self._reset()
+        self.root_key = key
+
+    def _root_visits(self):
+        start = self.first[self.root]
+        return self.visits[start:start + self.count[self.root]].tolist()
+
+    def _children(self, node):
+        return range(self.first[node], self.first[node] + self.count[node])
+
+    def root_stats(self):
+        return {self.actions[i]: (int(self.visits[i]), float(self.Q[i])) for i in self._children(self.root)}
+
+    def _best_move(self):
+        start = self.first[self.root]
+        best = start + int(np.argmax(self.visits[start:start + self.count[self.root]]))
+        return self.actions[best]
+
+    def update_with_move(self, last_move, next_player=None):
+        node = None
+        for i in self._children(self.root):
+            if self.actions[i] == last_move:
+                node = i
+                break
+        if node is not None and self.kind[node] == CHANCE:
+            node = self.outcomes.get(node, {}).get(next_player)
+        if node is None:
+            self._reset()
+        else:
+            self._compact(node)
+
+    def _reset(self):
+        self._allocate(len(self.visits))
+        self.root = self._new_nodes(1, NO_NODE, [None], [1.0], DECISION)
+        self.root_key = None
+
+    def _compact(self, root, threshold=None):
+        """Keep only the subtree of root, renumbered from 0 in breadth first
+        order so that children stay contiguous.
+        threshold: if given, the nodes other than root with at most this
+            many visits lose their subtrees, see MCTS._prune.
+        """
+        order = [root]
+        parent = [NO_NODE]
+        first = [0]
+        count = [0]
+        outcomes = {}
+        i = 0
+        while i < len(order):
+            old = order[i]
+            if i and threshold is not None and self.visits[old] <= threshold:
+                i += 1
+                continue
+            if self.count[old]:
+                first[i] = len(order)
+                count[i] = self.count[old]
+                for child in self._children(old):
+                    order.append(child)
+                    parent.append(i)
+                    first.append(0)
+                    count.append(0)
+            for player_id, outcome in self.outcomes.get(old, {}).items():
+                outcomes.setdefault(i, {})[player_id] = len(order)
+                order.append(outcome)
+                parent.append(i)
+                first.append(0)
+                count.append(0)
+            i += 1
+        order = np.array(order)
+        self.visits[:len(order)] = self.visits[order]
+        self.Q[:len(order)] = self.Q[order]
+        self.P[:len(order)] = self.P[order]
+        self.count[:len(order)] = count
+        self.kind[:len(order)] = self.kind[order]
+        self.bound[:len(order)] = self.bound[order]
+        self.parent[:len(order)] = parent
+        self.first[:len(order)] = first
+        self.actions = [self.actions[old] for old in order]
+        self.outcomes = outcomes
+        self.size = len(order)
+        self.root = 0
+        self.root_key = None
+
+    def _kept(self, threshold):
+        kept = 1
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            below = list(self._children(node)) + list(self.outcomes.get(node, {}).values())
+            kept += len(below)
+            stack.extend(child for child in below if self.visits[child] > threshold)
+        return kept
+
+    def _collapse(self, threshold):
+        root_key = self.root_key
+        self._compact(self.root, threshold)
+        self.root_key = root_key
+
+    def _visit_counts(self):
+        return np.unique(np.delete(self.visits[:self.size], self.root)).tolist()
+
+    def __str__(self):
+        return "ArrayMCTS"
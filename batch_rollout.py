@@ -0,0 +1,157 @@
+import numpy as np
+from MTCSPlayer import task_duration
+from rollout_policy import RolloutPolicy
+
+
+def bits_to_mask(bits, n):
+    """Convert an int bitset over n tasks into a boolean array."""
+    raw = np.frombuffer(bits.to_bytes((n + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder='little')[:n].astype(bool)
+
+
+class BatchRollout(object):
+    """Simulate K random completions of the same board state at once.
+
+    Every rollout keeps its own predecessor counters, ready mask, agent
+    finish times and clock in (K, ...) arrays, and all rollouts take one
+    step per iteration: a rollout with an idle agent that can take a ready
+    task assigns one, every other rollout jumps its clock to the next task
+    completion. This follows the Board rules, and the WRCChess rules when
+    agents are restricted to the task types of their agent type.
+    Tasks are picked at random or by the priorities of a rollout policy
+    (see rollout_policy.RolloutPolicy).
+    """
+
+    def __init__(self, game_state, n_rollout=16, stat='mean', limit=100000, policy='random', epsilon=0.1):
+        self.n_rollout = n_rollout
+        self.stat = stat
+        self.limit = limit
+        self.tasks = game_state['tasks']
+        self.task_id = game_state['task_id']
+        self.n_task = len(self.tasks)
+        self.succ_ptr = game_state['succ_ptr'].astype(np.int64)
+        self.succ_idx = game_state['succ_idx'].astype(np.int64)
+        self.out_degree = np.diff(self.succ_ptr)
+        self.required = game_state['required']
+        self.duration = np.array([task_duration[task[0]] for task in self.tasks], dtype=np.int64)
+        self.letters = np.array([task[0] for task in self.tasks])
+        self._capability = {}
+        self.epsilon = epsilon if policy == 'epsilon' else 0.0
+        if policy == 'random':
+            self.priority = None
+        else:
+            self.priority = RolloutPolicy(game_state, policy, epsilon).priority
+
+    def capability(self, board):
+        """Return the agent type index of every player and a (types, tasks)
+        boolean matrix of which task each agent type can take."""
+        capabilities = board.capabilities()
+        key = tuple(sorted((agent_type, tuple(sorted(letters))) for agent_type, letters in capabilities.items()))
+        if key not in self._capability:
+            types = sorted(capabilities)
+            cap = np.array([np.isin(self.letters, list(capabilities[agent_type])) for agent_type in types])
+            self._capability[key] = types, cap
+        types, cap = self._capability[key]
+        agent_type = np.array([types.index(player.type) for player in board.players])
+        return agent_type, cap
+
+    def simulate(self, board, rng=np.random):
+        """Play n_rollout random completions of board and return their
+        makespans. The board itself is not modified."""
+        k, n = self.n_rollout, self.n_task
+        end, used_time = board.game_end()
+        if end:
+            return np.full(k, used_time, dtype=np.int64)
+        agent_type, cap = self.capability(board)
+        cap_count = cap.T.astype(np.int64)
+        n_player = len(board.players)
+        rows = np.arange(k)
+        player_ids = np.arange(n_player)
+        no_finish = np.iinfo(np.int64).max
+
+        assigned = bits_to_mask(board.assigned, n)
+        pending = np.tile(np.array(board.pending, dtype=np.int64), (k, 1))
+        ready = np.tile((pending[0] == 0) & ~assigned, (k, 1))
+        running = np.full((k, n_player), -1, dtype=np.int64)
+        finish = np.full((k, n_player), board.counter, dtype=np.int64)
+        for player in board.players:
+            if player.task is not None:
+                running[:, player.id] = self.task_id[player.task]
+                finish[:, player.id] = player.finish
+        # number of ready tasks each agent type can take
+        type_ready = np.tile(ready[0] @ cap_count, (k, 1))
+        clock = np.full(k, board.counter, dtype=np.int64)
+        left = np.full(k, board.n_left, dtype=np.int64)
+        # the player already drawn to move next, if the rules draw one
+        forced = board.current_player.id if board.random_next_player else -1
+
+        for _ in range(self.limit):
+            active = left > 0
+            if not active.any():
+                break
+            can_act = (running < 0) & (type_ready[:, agent_type] > 0) & active[:, None]
+            if forced >= 0:
+                can_act &= player_ids == forced
+                forced = -1
+            act = can_act.any(axis=1)
+
+            if act.any():
+                act_rows = rows[act]
+                agent_keys = np.where(can_act[act], rng.random_sample((len(act_rows), n_player)), -1.0)
+                agent = agent_keys.argmax(axis=1)
+                task_ok = ready[act_rows] & cap[agent_type[agent]]
+                task_keys = rng.random_sample((len(act_rows), n))
+                if self.priority is not None:
+                    greedy = rng.random_sample(len(act_rows)) >= self.epsilon
+                    task_keys[greedy] += self.priority
+                task_keys = np.where(task_ok, task_keys, -1.0)
+                task = task_keys.argmax(axis=1)
+                running[act_rows, agent] = task
+                finish[act_rows, agent] = clock[act_rows] + self.duration[task]
+                ready[act_rows, task] = False
+                type_ready[act_rows] -= cap_count[task]
+
+            advance = active & ~act
+            if advance.any():
+                busy = running >= 0
+                next_finish = np.where(busy, finish, no_finish).min(axis=1)
+                clock[advance] = next_finish[advance]
+                completing = busy & (finish == clock[:, None]) & advance[:, None]
+                done_rows, done_agents = np.nonzero(completing)
+                done_tasks = running[done_rows, done_agents]
+                running[done_rows, done_agents] = -1
+                np.subtract.at(left, done_rows, self.required[done_tasks])
+                self._release(pending, ready, type_ready, cap_count, done_rows, done_tasks)
+        else:
+            print("WARNING: batched rollout reached step limit")
+        return clock
+
+    def _release(self, pending, ready, type_ready, cap_count, done_rows, done_tasks):
+        counts = self.out_degree[done_tasks]
+        total = counts.sum()
+        if not total:
+            return
+        starts = np.repeat(self.succ_ptr[done_tasks], counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        next_tasks = self.succ_idx[starts + offsets]
+        next_rows = np.repeat(done_rows, counts)
+        np.subtract.at(pending, (next_rows, next_tasks), 1)
+        released = pending[next_rows, next_tasks] == 0
+        if released.any():
+            # a task finishing the last two predecessors at once shows up twice
+            pairs = np.unique(next_rows[released] * self.n_task + next_tasks[released])
+            next_rows, next_tasks = pairs // self.n_task, pairs % self.n_task
+            ready[next_rows, next_tasks] = True
+            np.add.at(type_ready, next_rows, cap_count[next_tasks])
+
+    def evaluate(self, board, rng=np.random):
+        """Return the configured statistic of the simulated makespans."""
+        return summarize(self.simulate(board, rng))[self.stat]
+
+
+def summarize(makespans):
+    """Distribution statistics of a batch of rollout makespans."""
+    return {'mean': float(np.mean(makespans)),
+            'min': float(np.min(makespans)),
+            'max': float(np.max(makespans)),
+            'std': float(np.std(makespans))}
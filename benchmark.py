@@ -0,0 +1,173 @@
+import argparse
+import json
+import platform
+import random
+import time
+import numpy as np
+import dag
+import multi_tasking_team
+import mixed_team
+from precedence_graph import precedence_graph
+from scaffold import resolve
+from MTCSPlayer import make_mcts, policy_value_fn
+from game_runner import play_seeded
+
+
+# team sizes per game mode: (player_num,) or (humanoid_num, robot_num)
+TEAMS = {'multi': [(3,), (8,)],
+         'mixed': [(3, 2), (5, 3)]}
+# metrics where larger is better, all others are better smaller
+HIGHER_IS_BETTER = {'rollouts_per_s', 'playouts_per_s'}
+# metrics judged by the schedule, not by speed
+QUALITY = {'makespan'}
+
+
+def workload_key(entry):
+    return '%s/%s/%s' % (entry['scaffold'], entry['mode'], 'x'.join(str(n) for n in entry['team']))
+
+
+def new_board(mode, game_state, team):
+    """A fresh board of a game of mode with the given team."""
+    if mode == 'multi':
+        return multi_tasking_team.MultiPlayerGame(game_state, team[0], 10, 1).board
+    game = mixed_team.WRCGame(game_state, team[0], team[1], 10, 1)
+    game.board.set_current_player(team[0])
+    return game.board
+
+
+def load_time(scaffold):
+    """Seconds to load a compiled graph, without the in-process cache."""
+    init, path = precedence_graph[resolve(scaffold)]
+    dag.load_dag(path, init)  # compile once if needed
+    dag.clear_cache()
+    start = time.perf_counter()
+    game_state = dag.load_dag(path, init)
+    return time.perf_counter() - start, game_state
+
+
+def clone_time(board, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        board.clone()
+    return (time.perf_counter() - start) / repeat
+
+
+def rollout_rate(board, repeat):
+    """Complete random rollouts from board per second."""
+    mcts = make_mcts(policy_value_fn, 10, 1)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        mcts._evaluate_rollout(board.clone())
+    return repeat / (time.perf_counter() - start)
+
+
+def playout_rate(board, n_playout):
+    """MCTS playouts from board per second."""
+    mcts = make_mcts(policy_value_fn, 10, n_playout)
+    start = time.perf_counter()
+    n = mcts.search(board)
+    return n / (time.perf_counter() - start)
+
+
+def play(mode, game_state, team, n_playout, seed):
+    if mode == 'multi':
+        config = {'player_num': team[0], 'c': 10, 'round_num': n_playout, 'search_options': {}}
+        return play_seeded(multi_tasking_team.play_game, game_state, config, 0, seed)
+    config = {'humanoid_num': team[0], 'robot_num': team[1], 'c': 10, 'round_num': n_playout, 'search_options': {}}
+    return play_seeded(mixed_team.play_game, game_state, config, 0, seed)
+
+
+def run_workload(scaffold, mode, team, args):
+    load_s, game_state = load_time(scaffold)
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    board = new_board(mode, game_state, team)
+    entry = {'scaffold': scaffold, 'mode': mode, 'team': list(team),
+             'load_s': load_s,
+             'clone_s': clone_time(board, args.clones),
+             'rollouts_per_s': rollout_rate(board, args.rollouts),
+             'playouts_per_s': playout_rate(board, args.playouts)}
+    result = play(mode, game_state, team, args.N, args.seed)
+    move_time = np.array(result['move_time'])
+    entry.update({'decision_s_mean': float(move_time.mean()),
+                  'decision_s_p95': float(np.percentile(move_time, 95)),
+                  'game_s': result['time'],
+                  'makespan': result['makespan']})
+    return entry
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of every metric against baseline.
+    Return: the (workload, metric, change) of the regressions beyond
+        tolerance, a relative change for speed and absolute for makespan
+    """
+    old = {workload_key(entry): entry for entry in baseline['workloads']}
+    regressions = []
+    for entry in results['workloads']:
+        key = workload_key(entry)
+        if key not in old:
+            print(key, 'not in baseline')
+            continue
+        changes = []
+        for metric, value in entry.items():
+            if metric in ('scaffold', 'mode', 'team') or metric not in old[key]:
+                continue
+            before = old[key][metric]
+            if metric in QUALITY:
+                change = value - before
+                worse = change > 0
+                changes.append('%s %+d' % (metric, change))
+            else:
+                change = value / before - 1 if before else 0.0
+                worse = -change > tolerance if metric in HIGHER_IS_BETTER else change > tolerance
+                changes.append('%s %+.0f%%' % (metric, 100 * change))
+            if worse:
+                regressions.append((key, metric, change))
+        print(key, ' '.join(changes))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark speed and schedule quality')
+    parser.add_argument('--scaffolds', nargs='*', default=list(precedence_graph), help='Scaffold types to run, <stories>x<spans> ones are generated')
+    parser.add_argument('--modes', nargs='*', default=list(TEAMS), choices=list(TEAMS), help='Game modes to run')
+    parser.add_argument('--N', default=10, type=int, help='Number of simulations per move of the played games')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of every workload')
+    parser.add_argument('--clones', default=200, type=int, help='Board clones timed per workload')
+    parser.add_argument('--rollouts', default=20, type=int, help='Rollouts timed per workload')
+    parser.add_argument('--playouts', default=100, type=int, help='Playouts timed per workload')
+    parser.add_argument('--output', default='benchmark.json', type=str, help='JSON file the results are written to')
+    parser.add_argument('--baseline', default=None, type=str, help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', default=0.1, type=float, help='Relative slowdown reported as a regression')
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    results = {'python': platform.python_version(),
+               'numpy': np.__version__,
+               'machine': platform.machine(),
+               'settings': {'N': args.N, 'seed': args.seed, 'clones': args.clones,
+                            'rollouts': args.rollouts, 'playouts': args.playouts},
+               'workloads': []}
+    for scaffold in args.scaffolds:
+        for mode in args.modes:
+            for team in TEAMS[mode]:
+                entry = run_workload(scaffold, mode, team, args)
+                print('%s  load %.4fs  clone %.1fus  %.1f rollouts/s  %.1f playouts/s  decision %.3fs (p95 %.3fs)  makespan %d'
+                      % (workload_key(entry), entry['load_s'], 1e6 * entry['clone_s'], entry['rollouts_per_s'],
+                         entry['playouts_per_s'], entry['decision_s_mean'], entry['decision_s_p95'], entry['makespan']))
+                results['workloads'].append(entry)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for key, metric, change in regressions:
+            print('REGRESSION', key, metric, change)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(run())
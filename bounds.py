@@ -0,0 +1,78 @@
+import numpy as np
+from MTCSPlayer import task_duration
+from rollout_policy import task_priorities
+
+
+class LowerBound(object):
+    """Lower bounds on the makespan of any completion of a board.
+
+    critical path: every ready task still has its longest path to the end
+    of the graph ahead of it, and every running task the longest path
+    after it.
+    resource: the work left, plus the rest of the running tasks, spread
+    evenly over the agents able to do it; for every agent type over the
+    task types only that agent type can take, and over all agents.
+    The bound is the larger of the two.
+    """
+
+    def __init__(self, game_state):
+        self.task_id = game_state['task_id']
+        level = task_priorities(game_state)['critical_path']
+        # a task counts if it is required or something required waits for it
+        needed = game_state['required'] | (np.diff(game_state['succ_ptr']) > 0)
+        self.level = np.where(needed, level, 0).tolist()
+        self.tail = [level - task_duration[task[0]] for level, task in zip(self.level, game_state['tasks'])]
+        self._capability = None
+
+    def capability(self, board):
+        """Return the task types only one agent type can take, per agent
+        type, and the number of agents of every type. The team is taken
+        to be the same for every board, as it is within one game."""
+        if self._capability is None:
+            capabilities = board.capabilities()
+            exclusive = {}
+            for agent_type, letters in capabilities.items():
+                others = set()
+                for other, other_letters in capabilities.items():
+                    if other != agent_type:
+                        others |= set(other_letters)
+                exclusive[agent_type] = sorted(set(letters) - others)
+            counts = {}
+            for player in board.players:
+                counts[player.type] = counts.get(player.type, 0) + 1
+            self._capability = exclusive, counts
+        return self._capability
+
+    def critical_path(self, board):
+        level = self.level
+        tail = self.tail
+        task_id = self.task_id
+        bound = board.counter + max([level[task_id[task]] for task in board.ready_tasks()], default=0)
+        for player in board.players:
+            if player.task is not None:
+                bound = max(bound, player.finish + tail[task_id[player.task]])
+        return bound
+
+    def resource(self, board):
+        exclusive, counts = self.capability(board)
+        counter = board.counter
+        running = dict.fromkeys(counts, 0)
+        for player in board.players:
+            if player.task is not None:
+                running[player.type] += player.finish - counter
+        work_left = board.work_left
+        total = sum(work_left.values()) + sum(running.values())
+        bound = -(-total // len(board.players))
+        if len(counts) > 1:
+            for agent_type, letters in exclusive.items():
+                work = sum([work_left.get(letter, 0) for letter in letters]) + running[agent_type]
+                bound = max(bound, -(-work // counts[agent_type]))
+        return counter + bound
+
+    def __call__(self, board, incumbent=None):
+        """The lower bound of board. If it is at least incumbent, a bound
+        that is may be returned without computing the other."""
+        bound = self.critical_path(board)
+        if incumbent is not None and bound >= incumbent:
+            return bound
+        return max(bound, self.resource(board))
@@ -0,0 +1,112 @@
+import math
+import time
+
+
+# per move playout cap when only a time budget is given
+UNLIMITED = 10 ** 9
+
+
+def add_budget_args(parser):
+    """Add the game-wide budget options shared by both game scripts."""
+    parser.add_argument('--game_playouts', default=0, type=int, help='Playouts for a whole game, split over its moves; 0 uses N per move')
+    parser.add_argument('--game_time', default=0, type=float, help='Seconds of search for a whole game, split over its moves; 0 for no limit')
+
+
+def budget_options(args):
+    """Return the BudgetAllocator keyword arguments, or None if the game
+    has no game-wide budget."""
+    if not args.game_playouts and not args.game_time:
+        return None
+    return {'total_playouts': args.game_playouts, 'total_time': args.game_time}
+
+
+def remaining_decisions(board):
+    """Number of tasks not yet assigned, one decision each."""
+    return len(board.tasks) - bin(board.assigned).count('1')
+
+
+def uncertainty(mcts):
+    """How open the decision at the root still is, from the statistics a
+    reused tree already has: 1 without visits, lower the larger the share
+    of visits by which the leading action is ahead."""
+    visits = sorted(n_visits for n_visits, q in mcts.root_stats().values()) if hasattr(mcts, 'root_stats') else []
+    total = sum(visits)
+    if len(visits) < 2 or not total:
+        return 1.0
+    return 1.0 - (visits[-1] - visits[-2]) / total
+
+
+class BudgetAllocator(object):
+    """Split a playout and/or time budget for a whole game over its moves.
+
+    A move gets weight log(branching) * uncertainty, floored at min_weight
+    for the uncertainty, and also in proportion to the tasks still to be
+    assigned, since early moves shape most of the makespan. The moves to
+    come are assumed to have the average weight so far, shrinking linearly
+    with the tasks left, so a move gets
+        w / (w + mean_w * (remaining - 1) / 2)
+    of the budget left. Forced moves (one available task) get nothing.
+    Once the time budget is spent every move gets a single playout.
+    """
+
+    def __init__(self, total_playouts=0, total_time=0, min_weight=0.25):
+        self.total_playouts = total_playouts
+        self.total_time = total_time
+        self.min_weight = min_weight
+        self.playouts_left = total_playouts
+        self.time_left = total_time
+        self.weight_sum = 0.0
+        self.moves = 0
+        # one dict per move, see get_move
+        self.log = []
+
+    def allocate(self, board, mcts):
+        """Return the (n_playout, time_budget) of the move on board and the
+        weight and uncertainty it was given."""
+        branching = len(board.availables)
+        certainty = max(self.min_weight, uncertainty(mcts))
+        weight = math.log(branching) * certainty if branching > 1 else 0.0
+        self.weight_sum += weight
+        self.moves += 1
+        mean_weight = self.weight_sum / self.moves
+        remaining = max(1, remaining_decisions(board))
+        if weight <= 0:
+            share = 0.0
+        else:
+            share = weight / (weight + mean_weight * (remaining - 1) / 2)
+        n_playout = UNLIMITED
+        if self.total_playouts:
+            n_playout = max(1, int(round(share * self.playouts_left))) if share else 0
+        time_budget = share * self.time_left if self.total_time else 0
+        if self.total_time and not time_budget:
+            # the game's time is spent, and a time budget of 0 means no limit
+            n_playout = min(n_playout, 1)
+        return n_playout, time_budget, weight, certainty
+
+    def get_move(self, mcts, board):
+        """Search the move on board with its share of the budget, log the
+        allocation and return the move."""
+        n_playout, time_budget, weight, certainty = self.allocate(board, mcts)
+        start = time.perf_counter()
+        move = mcts.get_move(board, n_playout, time_budget)
+        seconds = time.perf_counter() - start
+        self.playouts_left = max(0, self.playouts_left - mcts.last_playouts)
+        self.time_left = max(0.0, self.time_left - seconds)
+        self.log.append({'move': len(self.log),
+                         'clock': board.counter,
+                         'branching': len(board.availables),
+                         'remaining': remaining_decisions(board),
+                         'uncertainty': certainty,
+                         'weight': weight,
+                         'playouts': None if n_playout == UNLIMITED else n_playout,
+                         'time_budget': time_budget,
+                         'spent': mcts.last_playouts,
+                         'seconds': seconds})
+        return move
+
+
+def print_log(log):
+    for entry in log:
+        print('move %(move)d  t=%(clock)d  branching %(branching)d  tasks left %(remaining)d  '
+              'uncertainty %(uncertainty).2f  playouts %(playouts)s  time %(time_budget).3fs  '
+              'spent %(spent)d in %(seconds).3fs' % entry)
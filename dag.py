@@ -0,0 +1,224 @@
+import hashlib
+import os
+import numpy as np
+
+
+# bump when the layout of the compiled files changes
+COMPILED_VERSION = 1
+# in-process cache of loaded game states, see load_dag
+_loaded = {}
+
+
+def task_sort_key(task):
+    """Order tasks by type letter, then by their number (A2 before A10)."""
+    return task[0], int(task[1:]) if task[1:].isdigit() else 0, task
+
+
+def source_tasks(forward_dict):
+    """Return the tasks without predecessors, the init state of a graph."""
+    all_stone = set(forward_dict)
+    successors = set()
+    for next_tasks in forward_dict.values():
+        successors.update(next_tasks)
+    return (all_stone | successors) - successors
+
+
+def compile_dag(forward_dict, init=None):
+    """Compile a precedence graph into the game state used by the boards.
+
+    forward_dict: a map from task to the set of its successors; every task of
+        the scaffold appears either as a key or as a successor.
+    init: the tasks that are available at the start of the game, by default
+        the sources of the graph.
+
+    Besides the set based relations (f_rel, b_rel, init, left), tasks are
+    given integer ids and the successors are stored in CSR form:
+    the successors of task i are succ_idx[succ_ptr[i]:succ_ptr[i + 1]].
+    n_pred holds the number of predecessors of each task, which the boards
+    copy and count down as tasks complete.
+    """
+    all_stone = set(forward_dict)
+    for next_tasks in forward_dict.values():
+        all_stone.update(next_tasks)
+    tasks = sorted(all_stone, key=task_sort_key)
+    if init is None:
+        init = source_tasks(forward_dict)
+    task_id = {task: i for i, task in enumerate(tasks)}
+    succ_ptr = np.zeros(len(tasks) + 1, dtype=np.int32)
+    succ_idx = []
+    for i, task in enumerate(tasks):
+        succ_idx.extend(sorted(task_id[item] for item in forward_dict.get(task, ())))
+        succ_ptr[i + 1] = len(succ_idx)
+    return game_state_from_arrays(tasks, succ_ptr, np.array(succ_idx, dtype=np.int32), init)
+
+
+def game_state_from_arrays(tasks, succ_ptr, succ_idx, init):
+    """Build the game state from the compiled CSR form of the graph."""
+    tasks = list(tasks)
+    init = set(init)
+    forward_dict = {}
+    reverse_dict = {}
+    for i, task in enumerate(tasks):
+        forward_dict[task] = set()
+        for next_id in succ_idx[succ_ptr[i]:succ_ptr[i + 1]]:
+            item = tasks[next_id]
+            forward_dict[task].add(item)
+            if item not in reverse_dict.keys():
+                reverse_dict[item] = set()
+            reverse_dict[item].add(task)
+    all_stone = set(tasks)
+
+    game_state = {"f_rel": forward_dict, "b_rel": reverse_dict, 'init': sorted(init, key=task_sort_key), 'left': all_stone-init,
+                  'tasks': tasks,
+                  'task_id': {task: i for i, task in enumerate(tasks)},
+                  'succ_ptr': succ_ptr,
+                  'succ_idx': succ_idx,
+                  'n_pred': np.bincount(succ_idx, minlength=len(tasks)).astype(np.int32),
+                  'required': np.array([task not in init for task in tasks], dtype=bool)}
+    return game_state
+
+
+def read_precedence_xlsx(xlsx_path):
+    """Read the forward relations from a data/dag_*.xlsx file: the first
+    column holds a task, the other columns its successors."""
+    import pandas as pd
+    df = pd.read_excel(xlsx_path, header=None, dtype=str)
+    forward_dict = {}
+    for index, row in df.iterrows():
+        forward_dict[row[0]] = set()
+        for r_idx, item in enumerate(row):
+            if not pd.isna(item):
+                if r_idx > 0:
+                        forward_dict[row[0]].add(item)
+    return forward_dict
+
+
+def compiled_path(xlsx_path):
+    """data/dag_2-2.xlsx is compiled to data/compiled/dag_2-2.npz"""
+    folder, name = os.path.split(xlsx_path)
+    return os.path.join(folder, 'compiled', os.path.splitext(name)[0] + '.npz')
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def save_compiled(path, tasks, succ_ptr, succ_idx, init, source=None):
+    """Write a compiled graph to path (a .npz file).
+    source: the (mtime_ns, size, sha1) of the file it was compiled from.
+    """
+    mtime_ns, size, digest = source if source else (0, 0, '')
+    init = set(init)
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f,
+                 version=COMPILED_VERSION,
+                 tasks=np.array(tasks),
+                 succ_ptr=succ_ptr,
+                 succ_idx=succ_idx,
+                 init=np.array([task in init for task in tasks], dtype=bool),
+                 source_mtime_ns=mtime_ns,
+                 source_size=size,
+                 source_sha1=digest)
+    # concurrent runs may compile the same graph, the last rename wins
+    os.replace(tmp_path, path)
+
+
+def load_compiled(path):
+    """Read a compiled .npz file.
+    Return: (tasks, succ_ptr, succ_idx, init, (mtime_ns, size, sha1))
+    """
+    with np.load(path) as data:
+        if int(data['version']) != COMPILED_VERSION:
+            raise ValueError('%s has an old layout' % path)
+        tasks = data['tasks'].tolist()
+        init = [task for task, is_init in zip(tasks, data['init']) if is_init]
+        source = (int(data['source_mtime_ns']), int(data['source_size']), str(data['source_sha1']))
+        return tasks, data['succ_ptr'], data['succ_idx'], init, source
+
+
+def load_dag(xlsx_path, init=None):
+    """Return the game state of the precedence graph in xlsx_path.
+
+    The graph is compiled once into compiled_path(xlsx_path) and then read
+    from there, which neither imports pandas nor parses the Excel file. The
+    compiled file is rebuilt when the xlsx changes: a different mtime or
+    size triggers a hash check, and a different hash a recompile.
+    Game states are never modified, so each is loaded once per process.
+    xlsx_path may also be a compiled .npz file without a source, like the
+    graphs of scaffold.register.
+    init: the initial tasks, by default those stored with the graph, or the
+        sources of the graph when it is compiled.
+    """
+    key = (xlsx_path, None if init is None else frozenset(init))
+    if key in _loaded:
+        return _loaded[key]
+    path = compiled_path(xlsx_path)
+    if xlsx_path.endswith('.npz'):
+        compiled = load_compiled(xlsx_path)[:4]
+    else:
+        compiled = _load_current(path, xlsx_path)
+    if compiled is None:
+        game_state = compile_dag(read_precedence_xlsx(xlsx_path), init)
+        _try_save(path, game_state['tasks'], game_state['succ_ptr'], game_state['succ_idx'], game_state['init'],
+                  _source(xlsx_path))
+    else:
+        tasks, succ_ptr, succ_idx, compiled_init = compiled
+        game_state = game_state_from_arrays(tasks, succ_ptr, succ_idx, compiled_init if init is None else init)
+    # where derived tables (e.g. rollout_policy.task_priorities) are cached
+    game_state['path'] = xlsx_path
+    _loaded[key] = game_state
+    return game_state
+
+
+def clear_cache():
+    """Forget the game states loaded by this process."""
+    _loaded.clear()
+
+
+def _source(xlsx_path):
+    stat = os.stat(xlsx_path)
+    return stat.st_mtime_ns, stat.st_size, file_digest(xlsx_path)
+
+
+def _load_current(path, xlsx_path):
+    """Return the compiled arrays in path if they match xlsx_path, else None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        tasks, succ_ptr, succ_idx, init, source = load_compiled(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    stat = os.stat(xlsx_path)
+    if source[:2] != (stat.st_mtime_ns, stat.st_size):
+        current = _source(xlsx_path)
+        if current[2] != source[2]:
+            return None
+        # touched but unchanged, remember the new mtime
+        _try_save(path, tasks, succ_ptr, succ_idx, init, current)
+    return tasks, succ_ptr, succ_idx, init
+
+
+def _try_save(path, *compiled):
+    try:
+        save_compiled(path, *compiled)
+    except OSError as e:
+        print('WARNING: could not write compiled graph', path, e)
+
+
+def successor_lists(game_state):
+    """Return the CSR successor arrays as python lists for scalar loops."""
+    return game_state['succ_ptr'].tolist(), game_state['succ_idx'].tolist()
+
+
+def task_mask(game_state, tasks):
+    """Return the bitset (a python int) of the given task names."""
+    task_id = game_state['task_id']
+    mask = 0
+    for task in tasks:
+        mask |= 1 << task_id[task]
+    return mask
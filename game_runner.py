@@ -0,0 +1,153 @@
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from budget import print_log
+from results import compact
+
+
+# the compiled precedence graph of this worker process, see init_worker
+_game_state = None
+
+
+def init_worker(game_state):
+    """Initializer of the worker processes of GamePool and
+    parallel_search.SearchPool: the graph is sent to each worker once."""
+    global _game_state
+    _game_state = game_state
+
+
+def worker_game_state():
+    """The precedence graph of this worker process."""
+    return _game_state
+
+
+def game_seeds(seed, total_game):
+    """Deterministic, independent seeds for total_game games."""
+    return [int(s) for s in np.random.SeedSequence(seed).generate_state(total_game)]
+
+
+def play_seeded(play_game, game_state, config, game_index, seed):
+    """Seed the python and NumPy generators, then play one game.
+    play_game(game_state, config) returns a dict of results.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    result = play_game(game_state, config)
+    result['game'] = game_index
+    result['seed'] = seed
+    return result
+
+
+def report_move(moves, board, seconds, playouts):
+    """Put the move just played on board on the moves queue: the task, the
+    player it went to, its start and end, and the search that chose it."""
+    task, player_id, start, end = board.record[-1]
+    moves.put({'move': len(board.record) - 1, 'task': task, 'player': player_id, 'start': start, 'end': end,
+               'seconds': seconds, 'playouts': playouts})
+
+
+def _play_in_worker(play_game, config, game_index, seed):
+    return play_seeded(play_game, _game_state, config, game_index, seed)
+
+
+class GamePool(object):
+    """Play games of one precedence graph, in this process or, with
+    workers > 1, over a process pool that holds the graph. A pool can be
+    shared by games of many configurations."""
+
+    def __init__(self, game_state, workers=1):
+        self.game_state = game_state
+        self.executor = None
+        if workers > 1:
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                initargs=(game_state,))
+
+    def play(self, play_game, games):
+        """Play the (config, game_index, seed) games and yield the position
+        in games and the result dict of each as soon as it completes."""
+        if self.executor is None:
+            for k, (config, game_index, seed) in enumerate(games):
+                yield k, play_seeded(play_game, self.game_state, config, game_index, seed)
+            return
+        futures = {self.executor.submit(_play_in_worker, play_game, config, game_index, seed): k
+                   for k, (config, game_index, seed) in enumerate(games)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def run_games(play_game, game_state, config, total_game, workers=1, seed=0, skip=()):
+    """Play total_game independent games and yield each result dict as soon
+    as its game completes. With workers > 1 the games are spread over a
+    process pool; the precedence graph is sent to every worker once.
+    Every game gets its own seed, so results do not depend on workers.
+    skip: indices of games not to play, e.g. finished by an earlier run
+    """
+    pool = GamePool(game_state, workers)
+    try:
+        games = [(config, game_index, game_seed) for game_index, game_seed in enumerate(game_seeds(seed, total_game))
+                 if game_index not in skip]
+        for k, result in pool.play(play_game, games):
+            yield result
+    finally:
+        pool.close()
+
+
+def print_result(result):
+    """Print the outcome of a finished game and what its searches counted."""
+    print('used time: ', result['time'])
+    print('cost: ', result['makespan'])
+    print('Agent usage: ', result['utilization'])
+    print('Playouts: ', result['playouts'])
+    if result['bounds']:
+        print('Pruned children: ', result['bounds']['pruned'], ' rollout cutoffs: ', result['bounds']['cutoffs'])
+    if result['nodes']:
+        print('Tree nodes: ', result['nodes']['current'], ' peak per tree: ', result['nodes']['peak'],
+              ' peak per process: ', result['nodes']['process_peak'], ' collapsed: ', result['nodes']['collapsed'])
+    if result['budget']:
+        print_log(result['budget'])
+    if result['tt']:
+        print('Transposition hit rate: ', result['tt']['hit_rate'], ' evictions: ', result['tt']['evictions'])
+    if result['trace'] and result['trace']['profile']:
+        print(result['trace']['profile'])
+
+
+def play_recorded(play_game, game_state, config, record_config, total_game, workers=1, seed=0, log=None):
+    """Play the games of run_games that log, a results.ResultLog, has no
+    record of yet, printing each and appending its record to log.
+    Return: the result dicts of the games played, and the compact records
+    of all games, those of log first
+    """
+    done = log.completed() if log is not None else {}
+    if done:
+        print('resuming: ', len(done), ' games already played')
+    records = [done[game] for game in sorted(done)]
+    results = []
+    for result in run_games(play_game, game_state, config, total_game, workers, seed, skip=done):
+        print_result(result)
+        results.append(result)
+        records.append(compact(result, record_config))
+        if log is not None:
+            log.write(records[-1])
+    return results, records
+
+
+def summarize_games(results):
+    """Aggregate the results of finished games.
+    Return: a dict of mean/std statistics and the best (shortest) game.
+    """
+    makespan = [result['makespan'] for result in results]
+    utilization = [result['utilization'] for result in results]
+    c_time = [result['time'] for result in results]
+    return {'games': len(results),
+            'makespan_mean': float(np.mean(makespan)),
+            'makespan_std': float(np.std(makespan)),
+            'utilization_mean': float(np.mean(utilization)),
+            'utilization_std': float(np.std(utilization)),
+            'time_mean': float(np.mean(c_time)),
+            'time_std': float(np.std(c_time)),
+            'best': min(results, key=lambda result: result['makespan'])}
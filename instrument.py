@@ -0,0 +1,177 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+
+
+# the phases of a playout, timed in this order by MCTS.search and _playout
+PHASES = ('clone', 'select', 'game_end', 'expand', 'rollout', 'backup')
+# counters of the playouts: rollout_moves counts the moves of scalar
+# rollouts, scans the membership tests of availables during selection
+COUNTERS = ('playouts', 'nodes', 'rollout_moves', 'scans', 'clones', 'clone_bytes')
+
+
+def add_instrument_args(parser):
+    """Add the instrumentation options shared by both game scripts."""
+    parser.add_argument('--instrument', action='store_true', help='Time the phases of every playout and print a summary table')
+    parser.add_argument('--trace', default=None, type=str, help='JSON lines file the per move statistics are written to, implies --instrument')
+    parser.add_argument('--profile', default=0, type=int, help='Number of decisions per game to run under cProfile, implies --instrument')
+
+
+def instrument_options(args):
+    """Return the Tracer keyword arguments, or None if the run is not
+    instrumented."""
+    if not args.instrument and not args.trace and not args.profile:
+        return None
+    return {'profile': args.profile}
+
+
+class SearchStats(object):
+    """Per phase timers and counters of the playouts of a search, collected
+    while set as mcts.stats. The timers are laps: each phase is charged the
+    time since the previous lap, so the phases add up to the playouts.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.time = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.depth = 0
+        self.max_depth = 0
+        self.last = 0.0
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.time[phase] += now - self.last
+        self.last = now
+
+    def playout(self, depth, nodes):
+        """Count a finished playout that went depth nodes deep and allocated
+        nodes new nodes."""
+        self.counts['playouts'] += 1
+        self.counts['nodes'] += nodes
+        self.depth += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def take(self):
+        """Return the statistics since the last take as a dict and start
+        over."""
+        stats = {'phase_s': dict(self.time), 'max_depth': self.max_depth}
+        stats.update(self.counts)
+        stats['depth'] = self.depth / self.counts['playouts'] if self.counts['playouts'] else 0.0
+        self.reset()
+        return stats
+
+
+class Tracer(object):
+    """Record a game move by move: the decision time, the playouts and, for
+    searches in this process, their SearchStats. With profile > 0 the
+    first profile decisions run under cProfile.
+    """
+
+    def __init__(self, profile=0, profile_lines=25):
+        self.moves = []
+        self.profile = profile
+        self.profile_lines = profile_lines
+        self.profiler = cProfile.Profile() if profile else None
+
+    def enable(self, players):
+        """Collect the SearchStats of the players' searches. Searches spread
+        over processes only report their playouts."""
+        for player in players:
+            if hasattr(player.mcts, '_playout'):
+                player.mcts.stats = SearchStats()
+
+    def begin(self):
+        """Call right before a decision is searched."""
+        if self.profiler is not None and len(self.moves) < self.profile:
+            self.profiler.enable()
+
+    def end(self, board, mcts, move, seconds):
+        """Call right after a decision, before move is played on board."""
+        if self.profiler is not None and len(self.moves) < self.profile:
+            self.profiler.disable()
+        entry = {'move': len(self.moves),
+                 'clock': board.counter,
+                 'branching': len(board.availables),
+                 'task': move,
+                 'seconds': seconds,
+                 'searched': mcts.last_playouts,
+                 'tree_nodes': getattr(mcts, 'size', None)}
+        stats = getattr(mcts, 'stats', None)
+        if stats is not None:
+            entry.update(stats.take())
+        self.moves.append(entry)
+
+    def profile_report(self):
+        """The functions taking the most cumulative time in the profiled
+        decisions, as text."""
+        if self.profiler is None or not self.moves:
+            return None
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(self.profile_lines)
+        return out.getvalue()
+
+    def trace(self):
+        return {'moves': self.moves, 'profile': self.profile_report()}
+
+
+def summarize_trace(moves):
+    """Sum the per move statistics of one or more traced games.
+    Return: the total seconds per phase, 'other' for the decision time
+        outside the playouts, and the counter totals
+    """
+    summary = {'moves': len(moves),
+               'seconds': sum(entry['seconds'] for entry in moves),
+               'phase_s': dict.fromkeys(PHASES, 0.0),
+               'max_depth': 0,
+               'depth': 0.0}
+    summary.update(dict.fromkeys(COUNTERS, 0))
+    for entry in moves:
+        if 'phase_s' not in entry:
+            continue
+        for phase, seconds in entry['phase_s'].items():
+            summary['phase_s'][phase] += seconds
+        for counter in COUNTERS:
+            summary[counter] += entry[counter]
+        summary['depth'] += entry['depth'] * entry['playouts']
+        summary['max_depth'] = max(summary['max_depth'], entry['max_depth'])
+    if summary['playouts']:
+        summary['depth'] /= summary['playouts']
+    summary['phase_s']['other'] = summary['seconds'] - sum(summary['phase_s'].values())
+    return summary
+
+
+def print_summary(results):
+    """Print the phase and counter table of the traced games in results."""
+    moves = [entry for result in results if result.get('trace') for entry in result['trace']['moves']]
+    summary = summarize_trace(moves)
+    playouts = summary['playouts']
+    print('%-10s %10s %7s %12s' % ('phase', 'seconds', 'share', 'us/playout'))
+    for phase, seconds in summary['phase_s'].items():
+        share = seconds / summary['seconds'] if summary['seconds'] else 0.0
+        per_playout = 1e6 * seconds / playouts if playouts else 0.0
+        print('%-10s %10.3f %6.1f%% %12.1f' % (phase, seconds, 100 * share, per_playout))
+    print('%-10s %10.3f' % ('decisions', summary['seconds']))
+    print('%-13s %12s %12s' % ('counter', 'total', 'per playout'))
+    for counter in COUNTERS:
+        print('%-13s %12d %12.1f' % (counter, summary[counter], summary[counter] / playouts if playouts else 0.0))
+    print('tree depth mean %.1f max %d' % (summary['depth'], summary['max_depth']))
+    return summary
+
+
+def write_trace(path, results):
+    """Write one JSON line per move of the traced games in results."""
+    with open(path, 'w') as f:
+        for result in results:
+            if not result.get('trace'):
+                continue
+            for entry in result['trace']['moves']:
+                line = dict(entry, game=result.get('game'), seed=result.get('seed'))
+                f.write(json.dumps(line) + '\n')
@@ -0,0 +1,83 @@
+def playable(state, macro):
+    """The first task of macro the player to move on state can take, or
+    None."""
+    for task in macro:
+        if task in state.availables:
+            return task
+    return None
+
+
+def play_macro(state, macro):
+    """Assign the tasks of macro, a joint assignment of the agents idle at
+    the next decision time of state, one by one. Each is given to the
+    player the board has to move; playing stops early if none of the
+    tasks left fit that player, or the clock moves on."""
+    time = state.decision_time()
+    left = list(macro)
+    while left:
+        task = playable(state, left)
+        if task is None:
+            return
+        left.remove(task)
+        state.do_move(task)
+        if state.game_end()[0] or state.decision_time() != time:
+            return
+
+
+def sample_macros(state, choose, n_sample):
+    """Sample n_sample joint assignments from state: tasks are picked with
+    choose, the rollout policy, until no agent is idle at the decision
+    time any more. The order tasks are assigned in within a decision time
+    does not change the schedule, so they are kept sorted.
+    Return: (macro, share of the samples) pairs
+    """
+    counts = {}
+    for _ in range(n_sample):
+        sample = state.clone()
+        time = sample.decision_time()
+        tasks = []
+        while True:
+            task = choose(sample)
+            tasks.append(task)
+            sample.do_move(task)
+            if sample.game_end()[0] or sample.decision_time() != time:
+                break
+        macro = tuple(sorted(tasks))
+        counts[macro] = counts.get(macro, 0) + 1
+    return [(macro, count / n_sample) for macro, count in counts.items()]
+
+
+class MacroPlan(object):
+    """The tasks left of the joint assignment a search chose, handed out
+    one per move while the game is still at the decision time it was
+    chosen for."""
+
+    def __init__(self):
+        self.time = None
+        self.tasks = []
+
+    def start(self, state, macro):
+        """Follow macro from state; return its first move."""
+        self.time = state.decision_time()
+        self.tasks = list(macro)
+        return self.next(state)
+
+    def start_best(self, state, macros):
+        """Follow the first of macros, best first, that the player to move
+        on state can take a task of; return its first move, or None if it
+        can take none."""
+        for macro in macros:
+            move = self.start(state, macro)
+            if move is not None:
+                return move
+        self.tasks = []
+        return None
+
+    def next(self, state):
+        """The next move of the plan, or None if it no longer applies."""
+        if not self.tasks or state.decision_time() != self.time:
+            return None
+        task = playable(state, self.tasks)
+        if task is not None:
+            self.tasks.remove(task)
+        return task
@@ -1,14 +1,150 @@
 import argparse
-import copy
+import sys
 import time
 from multi_tasking_team import Board, load_game_data
 import numpy as np
 from random import choice
 from precedence_graph import precedence_graph
-from MTCSPlayer import MTCSPlayer, task_duration
+from scaffold import resolve
+from MTCSPlayer import MTCSPlayer, task_duration, add_search_args, search_options, table_stats, bound_stats, node_stats
+from parallel_search import SearchPool
+from game_runner import play_recorded, summarize_games, report_move
+from results import ResultLog, add_results_args
+from budget import BudgetAllocator, add_budget_args, budget_options
+from instrument import Tracer, add_instrument_args, instrument_options, print_summary, write_trace
+
+
+# the task types every agent type can take, unless the game config has
+# its own 'task_constraints'
+task_constraints = {
+    'humanoid': {'C', 'D', 'F', 'H'},
+    # 'humanoid': {'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H'}
+    'robot': {'A', 'B', 'E', 'G'}}
+# every task type is one bit of a task type mask
+TASK_BIT = {letter: 1 << i for i, letter in enumerate(sorted(task_duration))}
+
+
+def type_mask(letters):
+    """The mask of the task types in letters."""
+    mask = 0
+    for letter in letters:
+        mask |= TASK_BIT[letter]
+    return mask
+
+
+def check_constraints(constraints, game_state, agents):
+    """Check that the agents can take every task of the graph.
+    constraints: the task types of every agent type
+    agents: the number of agents of every agent type
+    Raises ValueError for unknown task types, an agent type without tasks
+    that has agents, or task types no agent can take.
+    """
+    covered = set()
+    for agent_type, letters in constraints.items():
+        unknown = set(letters) - set(TASK_BIT)
+        if unknown:
+            raise ValueError('unknown task types %s' % ''.join(sorted(unknown)))
+        if agents.get(agent_type):
+            if not letters:
+                raise ValueError('the %s agents can take no task' % agent_type)
+            covered |= set(letters)
+    missing = set(task[0] for task in game_state['tasks']) - covered
+    if missing:
+        raise ValueError('no agent can take the tasks of type %s' % ''.join(sorted(missing)))
+
+
+class ReadyTasks(object):
+    """The ready tasks of an agent type, as a board's availables: a
+    collection of tasks with O(1) membership, add and remove that
+    iterates in the order they were added in, held in an ordered dict.
+    """
+    __slots__ = ('tasks',)
+
+    def __init__(self, tasks=()):
+        self.tasks = dict.fromkeys(tasks)
+
+    def copy(self):
+        ready = object.__new__(ReadyTasks)
+        ready.tasks = self.tasks.copy()
+        return ready
+
+    def add(self, task):
+        self.tasks[task] = None
+
+    def discard(self, task):
+        self.tasks.pop(task, None)
+
+    def __contains__(self, task):
+        return task in self.tasks
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __iter__(self):
+        return iter(self.tasks)
+
+    def __repr__(self):
+        return repr(list(self.tasks))
+
+
+class CapabilityIndex(object):
+    """The ready tasks every agent type can take. An agent type's
+    capabilities are a task type mask, and its ready tasks a ReadyTasks:
+    tasks are added and removed in O(1) and listed in the order they were
+    released in.
+    """
+
+    def __init__(self, constraints, tasks=()):
+        self.masks = {agent_type: type_mask(letters) for agent_type, letters in constraints.items()}
+        self.ready = {agent_type: ReadyTasks() for agent_type in constraints}
+        for task in tasks:
+            self.add(task)
+
+    def clone(self, availables=None, copied=None):
+        """Copy the index; the ready tasks that are availables, if any, are
+        replaced by their copy copied."""
+        index = object.__new__(CapabilityIndex)
+        index.masks = self.masks
+        index.ready = {agent_type: copied if ready is availables else ready.copy()
+                       for agent_type, ready in self.ready.items()}
+        return index
+
+    def add(self, task):
+        """Add a ready task to the agent types that can take it."""
+        bit = TASK_BIT[task[0]]
+        for agent_type, mask in self.masks.items():
+            if mask & bit:
+                self.ready[agent_type].add(task)
+
+    def remove(self, task):
+        """Remove a task that was started."""
+        for ready in self.ready.values():
+            ready.discard(task)
+
+    def can_act(self, agent_type, idle):
+        """Whether an agent of agent_type can start a task now, given the
+        idle agents of that type."""
+        return bool(idle) and bool(self.ready[agent_type])
+
+    def tasks(self, agent_type):
+        """The ready tasks of agent_type, kept up to date as tasks are
+        added and removed."""
+        return self.ready[agent_type]
+
+    def ready_tasks(self):
+        """Every ready task once: those of an agent type that an earlier one
+        can take were listed with the earlier one."""
+        seen = 0
+        for agent_type, ready in self.ready.items():
+            for task in ready:
+                if not seen & TASK_BIT[task[0]]:
+                    yield task
+            seen |= self.masks[agent_type]
 
 
 class WRCChess(Board):
+    random_next_player = True
+
     def __init__(self, init_game_state, players, h_ids, r_ids, r_tasks, h_tasks):
         super(WRCChess, self).__init__(init_game_state, players)
         self.h_ids = h_ids
@@ -19,56 +155,47 @@ class WRCChess(Board):
         self.active_human = set(h_ids)
         self.his_state = []
         self.next_player = None
-        self.robot_availables = [task for task in self.availables if task[0] in self.r_tasks]
-        self.human_availables = [task for task in self.availables if task[0] in self.h_tasks]
-        self.new_availables = []
-        self.available_his = None
-
-
-    def update_agent_state(self):
-        self.active_human = []
-        self.active_robot = []
-
-        for player in self.players:
-            player.work()
-            if player.duration <= 0:
-                if player.task:
-                    self.update_task_state(player.task)
-                if player.type == 'robot':
-                    self.active_robot.append(player.id)
-                else:
-                    self.active_human.append(player.id)
+        self.index = CapabilityIndex(self.capabilities(), self.availables)
+
+    def clone(self):
+        state = super(WRCChess, self).clone()
+        state.h_ids = self.h_ids
+        state.r_ids = self.r_ids
+        state.r_tasks = self.r_tasks
+        state.h_tasks = self.h_tasks
+        state.active_robot = set(self.active_robot)
+        state.active_human = set(self.active_human)
+        state.his_state = []
+        state.next_player = None
+        # availables, if the ready tasks of the current player's type, were
+        # copied by Board.clone already
+        state.index = self.index.clone(self.availables, state.availables)
+        return state
+
+    def clone_bytes(self):
+        size = super(WRCChess, self).clone_bytes()
+        ready_size = sum(sys.getsizeof(ready) + sys.getsizeof(ready.tasks) for ready in self.index.ready.values())
+        return size + sys.getsizeof(self.index) + ready_size
+
+    def capabilities(self):
+        return {'humanoid': self.h_tasks, 'robot': self.r_tasks}
+
+    def ready_tasks(self):
+        # availables only holds the tasks of the current player's type
+        return self.index.ready_tasks()
+
+    def decision_time(self):
+        # do_move only returns once the player to move can take a task
+        return self.counter
 
     def update_agent_state_step(self):
-        step_list = []
-        working_players = []
-        step = None
-        for player in self.players:
-            if player.duration > 0:
-                step_list.append(player.duration)
-                working_players.append(player.id)
-
-        if step_list:
-            step = min(step_list)
-            for _ in range(step):
-                self.record[self.counter] = {}
-                for id in working_players:
-                    working_player = self.players[id]
-                    self.record[self.counter][working_player.task] = id
-                self.counter += 1
-
-        for player_id in working_players:
-            player = self.players[player_id]
-            if step:
-                player.work_step(step)
-            if player.duration <= 0:
-                # self.current_active_players.append(player.id)
-                if player.task:
-                    self.update_task_state(player.task)
-                if player.type == 'robot':
-                    self.active_robot.add(player.id)
-                else:
-                    self.active_human.add(player.id)
+        if not self.events:
+            return
+        for player_id in self.advance():
+            if self.players[player_id].type == 'robot':
+                self.active_robot.add(player_id)
+            else:
+                self.active_human.add(player_id)
 
     # def check_task_type(self, task):
     #     if task[0] in self.r_tasks:
@@ -77,57 +204,24 @@ class WRCChess(Board):
     #         task_type = 'Human'
     #     return task_type
 
-    def game_end(self):
-        if not self.current_game_state['left']:
-            return True, self.counter
-        else:
-            return False, self.counter
-
-
-    def update_available_fast(self):
-        potential_tasks = self.current_game_state['backup']
-        for task in potential_tasks:
-            rel_tasks = self.current_game_state['b_rel'][task]
-            if rel_tasks <= self.current_game_state['done']:
-                if task not in self.availables:
-                    if task not in self.task_his:
-                        self.availables.append(task)
-                        self.new_availables.append(task)
-
-    def update_agent_available(self):
-        potential_stones = self.new_availables
-        if self.new_availables:
-            for task in potential_stones:
-                if task[0] in task_constraints['humanoid']:
-                    self.human_availables.append(task)
-                if task[0] in task_constraints['robot']:
-                    self.robot_availables.append(task)
-            self.available_his = self.availables[:]
-            self.new_availables = []
+    def release(self, task):
+        self.index.add(task)
 
     def fit_task(self):
-        available = set(i[0] for i in self.availables)
-
-        marker = -1
-        hf, rf = False, False
-        if self.active_human:
-            h = task_constraints['humanoid']
-            hf = list(available & h)
-            if hf:
-                marker = 0
-
-        if self.active_robot:
-            r = task_constraints['robot']
-            rf = list(available & r)
-            if rf:
-                marker = 1
-
+        """Return 0 if only humanoids can start a task now, 1 if only
+        robots can, 2 if both can and -1 if none can."""
+        hf = self.index.can_act('humanoid', self.active_human)
+        rf = self.index.can_act('robot', self.active_robot)
         if hf and rf:
-            marker = 2
-        return marker
+            return 2
+        if rf:
+            return 1
+        if hf:
+            return 0
+        return -1
 
     def do_move(self, task, show_log=False):
-        self.task_his.append(task)
+        self.assigned |= 1 << self.task_id[task]
 
         if show_log:
             print('#########################################')
@@ -135,17 +229,8 @@ class WRCChess(Board):
             print('available tasks: ', self.availables)
 
         # assign task to agent
-        self.players[self.current_player.id].assign_task(task, task_duration[task[0]])
-        if self.available_his:
-            self.availables = self.available_his
-        self.availables.remove(task)
-        if task in self.current_game_state['init']:
-            self.current_game_state['init'].remove(task)
-
-        if task in self.human_availables:
-            self.human_availables.remove(task)
-        if task in self.robot_availables:
-            self.robot_availables.remove(task)
+        self.start_task(self.players[self.current_player.id], task)
+        self.index.remove(task)
 
         if self.current_player.type == 'humanoid':
             self.active_human.remove(self.current_player.id)
@@ -160,7 +245,6 @@ class WRCChess(Board):
                 break
             else:
                 self.update_agent_state_step()
-                self.update_available_fast()
                 end, _ = self.game_end()
 
         # determine next player
@@ -172,73 +256,110 @@ class WRCChess(Board):
             next_id = choice(list(self.active_human)+list(self.active_robot))
 
         self.current_player = self.players[next_id]
-        self.update_agent_available()
-
-        if self.current_player.type == 'humanoid':
-            self.availables = self.human_availables[:]
-        else:
-            self.availables = self.robot_availables[:]
+        self.availables = self.index.tasks(self.current_player.type)
 
         end, _ = self.game_end()
-        if end:
+        if end and self.record is not None:
             self.check_idle()
 
     def check_idle(self):
-        idle = 0
-        h_idle = 0
-        r_idle = 0
-        player_num = len(self.players)
-        for item in self.record.values():
-            if item:
-                idle += player_num - len(item)
-
-                # check human idle
-                if self.h_ids:
-                    h_tmp = 0
-                    for h_id in self.h_ids:
-                        if h_id in item.values():
-                            h_tmp += 1
-                    h_idle += len(self.h_ids) - h_tmp
-
-                # check robot idle
-                if self.r_ids:
-                    r_tmp = 0
-                    for r_id in self.r_ids:
-                        if r_id in item.values():
-                            r_tmp += 1
-                    r_idle += len(self.r_ids) - r_tmp
-
-        self.idle['total'] = idle
-        self.idle['average_idle'] = idle / player_num
-
+        super(WRCChess, self).check_idle()
         if self.h_ids:
-            self.idle['human'] = h_idle / len(self.h_ids)
+            self.idle['human'] = self.idle_time('humanoid') / len(self.h_ids)
         if self.r_ids:
-            self.idle['robot'] = r_idle / len(self.r_ids)
+            self.idle['robot'] = self.idle_time('robot') / len(self.r_ids)
 
     def get_current_player(self):
         return self.current_player
 
+    def set_current_player(self, player_id):
+        """Let player_id move first; like after every move, it only sees
+        the tasks of its type."""
+        self.current_player = self.players[player_id]
+        self.availables = self.index.tasks(self.current_player.type)
+
 
 class WRCGame:
-    def __init__(self, game_state, human_player_num, robot_player_num, c, round_num):
+    def __init__(self, game_state, human_player_num, robot_player_num, c, round_num, constraints=None,
+                 **search_options):
         self.board = None
+        # the task types every agent type can take
+        self.constraints = constraints or task_constraints
+        check_constraints(self.constraints, game_state, {'humanoid': human_player_num, 'robot': robot_player_num})
         self.robot_player_num = robot_player_num
         self.human_player_num = human_player_num
         self.players = []
         self.c = c
         self.round_num = round_num
+        self.search_options = search_options
         self.game_structure = game_state
         self.init_game()
 
     def init_game(self):
         for h_id in range(self.human_player_num):
-            self.players.append(MTCSPlayer(h_id, 'humanoid', self.c, self.round_num))
+            self.players.append(MTCSPlayer(h_id, 'humanoid', self.c, self.round_num, **self.search_options))
         h_ids = [i for i in range(self.human_player_num)]
         for r_id in range(self.human_player_num, self.human_player_num + self.robot_player_num):
-            self.players.append(MTCSPlayer(r_id, 'robot', self.c, self.round_num))
+            self.players.append(MTCSPlayer(r_id, 'robot', self.c, self.round_num, **self.search_options))
         r_ids = [i for i in range(self.human_player_num, self.human_player_num + self.robot_player_num)]
-        self.board = WRCChess(self.game_structure, self.players, h_ids, r_ids, task_constraints['robot'], task_constraints['humanoid'])
+        self.board = WRCChess(self.game_structure, self.players, h_ids, r_ids, self.constraints['robot'], self.constraints['humanoid'])
+
+
+def play_game(game_state, config):
+    """Play one game with the settings in config and return its results.
+    A queue in config['moves'] gets every move as it is played, see
+    game_runner.report_move."""
+    t1 = time.perf_counter()
+    start_player = config['humanoid_num']  # 0
+    wrc_game = WRCGame(game_state,
+                       human_player_num=config['humanoid_num'],
+                       robot_player_num=config['robot_num'],
+                       c=config['c'],
+                       round_num=config['round_num'],
+                       constraints=config.get('task_constraints'),
+                       pool=config.get('pool'),
+                       **config['search_options'])
+    wrc_game.board.set_current_player(start_player)
+    allocator = BudgetAllocator(**config['budget']) if config.get('budget') else None
+    tracer = Tracer(**config['instrument']) if config.get('instrument') else None
+    if tracer is not None:
+        tracer.enable(wrc_game.players)
+    move_time = []
+
+    while True:
+        player_in_turn = wrc_game.board.get_current_player()
+        t_move = time.perf_counter()
+        if tracer is not None:
+            tracer.begin()
+        if allocator is None:
+            move = player_in_turn.get_action(wrc_game.board)
+        else:
+            move = allocator.get_move(player_in_turn.mcts, wrc_game.board)
+        move_time.append(time.perf_counter() - t_move)
+        if tracer is not None:
+            tracer.end(wrc_game.board, player_in_turn.mcts, move, move_time[-1])
+        wrc_game.board.do_move(move, False)
+        if config.get('moves') is not None:
+            report_move(config['moves'], wrc_game.board, move_time[-1], player_in_turn.mcts.last_playouts)
+        # every player keeps the subtree of the move played and the player drawn
+        for player in wrc_game.players:
+            player.mcts.update_with_move(move, wrc_game.board.current_player.id)
+        end, used_time = wrc_game.board.game_end()
+        if end:
+            break
+    board = wrc_game.board
+    return {'makespan': used_time,
+            'time': time.perf_counter() - t1,
+            'idle': dict(board.idle),
+            'utilization': 1 - board.idle['average_idle'] / board.counter,
+            'schedule': board.schedule(),
+            'tt': table_stats(wrc_game.players),
+            'bounds': bound_stats(wrc_game.players),
+            'nodes': node_stats(wrc_game.players),
+            'playouts': sum(player.mcts.total_playouts for player in wrc_game.players),
+            'budget': allocator.log if allocator is not None else None,
+            'move_time': move_time,
+            'trace': tracer.trace() if tracer is not None else None}
 
 
 def run():
@@ -248,62 +369,53 @@ def run():
     robot_player_num = args.robot_num
     round_num = args.N
     c = args.C
-    scaffold_type = args.scaffold_type
+    scaffold_type = resolve(args.scaffold_type)
+    constraints = {'humanoid': set(args.humanoid_tasks), 'robot': set(args.robot_tasks)}
 
     print('total_game: ', total_game)
     print('C: ', c, ' round_num: ', round_num)
     print('type: ', scaffold_type)
 
-    if len(task_constraints['humanoid']) < 8:
+    if len(constraints['humanoid']) < len(TASK_BIT):
         print(humanoid_player_num, 'I-', robot_player_num, 'R')
     else:
         print(humanoid_player_num, 'M-', robot_player_num, 'R')
 
-    start_player = humanoid_player_num  # 0
-    total_time, idle_time = [], []
-    agent_utilization = []
-    c_time = []
-
-    best_used_time = 1e13
-    best_model = None
-    for _ in range(total_game):
-        t1 = time.perf_counter()
-
-        init_state = precedence_graph[scaffold_type][0]
-        GAME_STATE = load_game_data(precedence_graph[scaffold_type][1], init_state)
-
-        wrc_game = WRCGame(GAME_STATE,
-                           human_player_num=humanoid_player_num,
-                           robot_player_num=robot_player_num,
-                           c=c,
-                           round_num=round_num)
-        wrc_game.board.current_player = wrc_game.board.players[start_player]
-
-        while True:
-            player_in_turn = wrc_game.board.get_current_player()
-            move = player_in_turn.get_action(wrc_game.board)
-            wrc_game.board.do_move(move, False)
-            end, used_time = wrc_game.board.game_end()
-            if end:
-                t2 = time.perf_counter()
-                com_time = t2 - t1
-                c_time.append(com_time)
-                print('used time: ', com_time)
-                print('cost: ', used_time)
-
-                total_time.append(used_time)
-                agent_utilization.append(1 - wrc_game.board.idle['average_idle'] / wrc_game.board.counter)
-                print('Agent usage: ', 1 - wrc_game.board.idle['average_idle'] / wrc_game.board.counter)
-                idle_time.append(wrc_game.board.idle['total'])
-                if used_time < best_used_time:
-                    best_used_time = used_time
-                    best_model = copy.deepcopy(wrc_game)
-                break
-
-    print('best cost', best_model.board.counter)
+    init_state = precedence_graph[scaffold_type][0]
+    GAME_STATE = load_game_data(precedence_graph[scaffold_type][1], init_state)
+    check_constraints(constraints, GAME_STATE, {'humanoid': humanoid_player_num, 'robot': robot_player_num})
+    if args.game_workers > 1 and args.workers > 1:
+        print('WARNING: games run in parallel, searching each move in one process')
+    pool = SearchPool(GAME_STATE, args.workers) if args.workers > 1 and args.game_workers <= 1 else None
+    config = {'humanoid_num': humanoid_player_num, 'robot_num': robot_player_num, 'c': c, 'round_num': round_num,
+              'search_options': search_options(args), 'pool': pool, 'budget': budget_options(args),
+              'instrument': instrument_options(args), 'task_constraints': constraints}
+    # what the games of a result log must share to be resumed
+    record_config = {'mode': 'mixed', 'scaffold_type': scaffold_type, 'humanoid_num': humanoid_player_num,
+                     'robot_num': robot_player_num, 'c': c, 'round_num': round_num,
+                     'search_options': config['search_options'], 'budget': config['budget'], 'seed': args.seed,
+                     'task_constraints': {agent_type: sorted(letters) for agent_type, letters in constraints.items()}}
+    log = ResultLog(args.results, record_config) if args.results else None
+    results, records = play_recorded(play_game, GAME_STATE, config, record_config, total_game, args.game_workers,
+                                     args.seed, log)
+
+    if pool is not None:
+        pool.close()
+    if log is not None:
+        log.close()
+    if config['instrument']:
+        print_summary(results)
+        if args.trace:
+            write_trace(args.trace, results)
+    # the best model is the compact record of the shortest game
+    best_model = summarize_games(records)['best']
+    c_time = [record['time'] for record in records]
+    total_time = [record['makespan'] for record in records]
+    agent_utilization = [record['utilization'] for record in records]
+    print('best cost', best_model['makespan'])
     print('computational time', np.mean(c_time), ' std: ', np.std(c_time))
     print('average cost', np.mean(total_time), ' std: ', np.std(total_time))
-    print('Best agent usage: ', 1 - best_model.board.idle['average_idle'] / best_model.board.counter)
+    print('Best agent usage: ', best_model['utilization'])
     print('Average agent usage: ', np.mean(agent_utilization))
     return best_model
 
@@ -314,16 +426,20 @@ def parse_args():
 
     parser.add_argument('--humanoid_num', default=5, type=int, help='Number of humanoid robots (powerful)')
     parser.add_argument('--robot_num', default=3, type=int, help='Number of general transportation robots (less powerful)')
+    parser.add_argument('--humanoid_tasks', default=''.join(sorted(task_constraints['humanoid'])), type=str, help='Task types humanoid robots can take, e.g. ABCDEFGH')
+    parser.add_argument('--robot_tasks', default=''.join(sorted(task_constraints['robot'])), type=str, help='Task types transportation robots can take')
 
     parser.add_argument('--N', default=10, type=int, help='Number of simulations per round N')
     parser.add_argument('--C', default=10, type=int, help='Parameter for balancing utilization and exploration C')
-    parser.add_argument('--scaffold_type', default='2x10', type=str, help='Structure of scaffold')
+    parser.add_argument('--scaffold_type', default='2x10', type=str, help='Structure of scaffold: a registered type, or <stories>x<spans> to generate one')
+    parser.add_argument('--game_workers', default=1, type=int, help='Number of processes the games are spread over')
+    parser.add_argument('--seed', default=0, type=int, help='Seed the per game seeds are derived from')
+    add_search_args(parser)
+    add_budget_args(parser)
+    add_instrument_args(parser)
+    add_results_args(parser)
     return parser.parse_args()
 
 
 if __name__ == '__main__':
-    task_constraints = {
-        'humanoid': {'C', 'D', 'F', 'H'},
-        # 'humanoid': {'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H'}
-        'robot': {'A', 'B', 'E', 'G'}}
     best_model = run()
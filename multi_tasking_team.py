@@ -1,100 +1,210 @@
 import argparse
-import copy
+import heapq
+import sys
 import numpy as np
-from MTCSPlayer import MTCSPlayer, task_duration
-import pandas as pd
+from MTCSPlayer import MTCSPlayer, task_duration, add_search_args, search_options, table_stats, bound_stats, node_stats
 import time
 from precedence_graph import precedence_graph
+from scaffold import resolve
+from dag import load_dag, successor_lists, task_mask
+from parallel_search import SearchPool
+from game_runner import play_recorded, summarize_games, report_move
+from results import ResultLog, add_results_args
+from budget import BudgetAllocator, add_budget_args, budget_options
+from instrument import Tracer, add_instrument_args, instrument_options, print_summary, write_trace
+from transposition import zobrist_key, type_code, DONE, RUNNING, CLOCK, PLAYER
 
 
 class Board:
+    # whether do_move draws the player of the next move at random
+    random_next_player = False
+
     def __init__(self, init_game_state, players):
-        self.current_game_state = init_game_state
-        self.current_game_state['backup'] = set()
-        self.current_game_state['done'] = set()
-        self.record = {}
+        self.attach(init_game_state)
+        # (task, player id, start, end) of every task started, see start_task
+        self.record = []
+        # time assigned to tasks per agent type, including the running ones
+        self.busy = {}
         self.idle = {}
 
-        self.availables = copy.deepcopy(self.current_game_state['init'])
+        self.availables = list(self.current_game_state['init'])
 
-        self.task_his = []
+        # tasks are tracked by integer id, sets of tasks as int bitsets
+        self.pending = self.current_game_state['n_pred'].tolist()
+        self.done = 0
+        self.assigned = 0
+        self.n_left = len(self.current_game_state['left'])
+        # duration of the required tasks not started yet, per task type
+        self.work_left = {}
+        for task in self.current_game_state['left']:
+            self.work_left[task[0]] = self.work_left.get(task[0], 0) + task_duration[task[0]]
+        # zobrist hash of the done and running tasks, see state_hash
+        self.zobrist = 0
 
         self.players = players
+        # (finish time, player id) of the running tasks, a heap
+        self.events = []
         self.current_active_players = [player.id for player in self.players]
         self.current_player = None
         self.start_player_id = 0
 
         self.counter = 0
-        self.new_record()
-
-    def new_record(self):
-        if self.counter not in self.record.keys():
-            self.record[self.counter] = {}
 
+    def clone(self):
+        """Return a compact copy holding only what a playout mutates.
+        The compiled precedence graph is shared with this board, players are
+        replaced by AgentState copies and no record is kept.
+        """
+        state = object.__new__(type(self))
+        state.current_game_state = self.current_game_state
+        state.record = None
+        state.busy = {}
+        state.idle = {}
+        state.availables = self.availables.copy()
+        state.tasks = self.tasks
+        state.task_id = self.task_id
+        state.succ_ptr = self.succ_ptr
+        state.succ_idx = self.succ_idx
+        state.pending = self.pending[:]
+        state.required = self.required
+        state.done = self.done
+        state.assigned = self.assigned
+        state.n_left = self.n_left
+        state.work_left = dict(self.work_left)
+        state.zobrist = self.zobrist
+        state.players = [player.clone() for player in self.players]
+        state.events = self.events[:]
+        state.current_active_players = self.current_active_players[:]
+        if self.current_player is None:
+            state.current_player = None
+        else:
+            state.current_player = state.players[self.current_player.id]
+        state.start_player_id = self.start_player_id
+        state.counter = self.counter
+        return state
+
+    def clone_bytes(self):
+        """Approximate size in bytes of what clone copies: the board, the
+        containers that are not shared with this board and the players."""
+        state = self.clone()
+        shared = vars(self)
+        size = sys.getsizeof(state) + sys.getsizeof(vars(state))
+        for name, value in vars(state).items():
+            if isinstance(value, (list, dict, set)) and value is not shared.get(name):
+                size += sys.getsizeof(value)
+        for player in state.players:
+            size += sys.getsizeof(player) + sys.getsizeof(vars(player))
+        return size
+
+    def attach(self, game_state):
+        """Point the board at a compiled precedence graph."""
+        self.current_game_state = game_state
+        self.tasks = game_state['tasks']
+        self.task_id = game_state['task_id']
+        self.succ_ptr, self.succ_idx = successor_lists(game_state)
+        self.required = task_mask(game_state, game_state['left'])
+
+    def detach(self):
+        """Return a clone without the precedence graph. It is cheap to send
+        to a process that already holds the graph, which attaches it."""
+        state = self.clone()
+        state.current_game_state = None
+        state.tasks = None
+        state.task_id = None
+        state.succ_ptr = None
+        state.succ_idx = None
+        state.required = None
+        return state
+
+    def capabilities(self):
+        """Map every agent type to the task types it can take."""
+        return {player.type: set(task_duration) for player in self.players}
 
     def run_step(self):
-        step = min([p.duration for p in self.players])
-        for _ in range(step):
-            self.record[self.counter] = {}
-            for player in self.players:
-                self.record[self.counter][player.task] = player.id
-            self.counter += 1
-        self.check_availability_step(step)
-
-    def check_availability(self):
-        self.current_active_players = []
-        for player in self.players:
-            player.work()
-            if player.duration <= 0:
-                self.current_active_players.append(player.id)
-                self.update_task_state(player.task)
-
-        if self.current_active_players:
-            for task in self.current_game_state['backup']:
-                rel_tasks = self.current_game_state['b_rel'][task]
-                if rel_tasks <= self.current_game_state['done']:
-                    if task not in self.availables:
-                        if task not in self.task_his:
-                            self.availables.append(task)
-
-    def check_availability_step(self, step):
-        self.current_active_players = []
-        for player in self.players:
-            player.work_step(step)
-            if player.duration <= 0:
-                self.current_active_players.append(player.id)
-                if player.task:
-                    self.update_task_state(player.task)
-
-        if self.current_active_players:
-            for task in self.current_game_state['backup']:
-                rel_tasks = self.current_game_state['b_rel'][task]
-                if rel_tasks <= self.current_game_state['done']:
-                    if task not in self.availables:
-                        if task not in self.task_his:
-                            self.availables.append(task)
+        """Advance to the next task completion; the idle players are kept
+        in id order."""
+        self.current_active_players = sorted(self.current_active_players + self.advance())
+
+    def advance(self):
+        """Jump the clock to the next task completion and complete every
+        task finishing at that time.
+        Return: the ids of the players that became idle, in id order
+        """
+        finish, player_id = heapq.heappop(self.events)
+        finished = [player_id]
+        while self.events and self.events[0][0] == finish:
+            finished.append(heapq.heappop(self.events)[1])
+        self.counter = finish
+        for player_id in finished:
+            self.finish_task(self.players[player_id])
+        return finished
+
+    def start_task(self, player, task):
+        """Assign task to player at the current time."""
+        duration = task_duration[task[0]]
+        player.assign_task(task, self.counter + duration)
+        heapq.heappush(self.events, (player.finish, player.id))
+        player.key = zobrist_key(RUNNING, self.task_id[task], player.finish, type_code(player.type))
+        self.zobrist ^= player.key
+        if self.required >> self.task_id[task] & 1:
+            self.work_left[task[0]] -= duration
+        if self.record is not None:
+            self.record.append((task, player.id, self.counter, self.counter + duration))
+            self.busy[player.type] = self.busy.get(player.type, 0) + duration
+
+    def finish_task(self, player):
+        """Complete the task of a player, which becomes idle."""
+        self.zobrist ^= player.key
+        player.key = 0
+        task, player.task = player.task, None
+        self.update_task_state(task)
+
+    def state_hash(self):
+        """Hash of the done tasks, the running tasks with their finish times
+        and agent types, and the current time. States reached by assigning
+        the same tasks in a different order share it."""
+        key = self.zobrist ^ zobrist_key(CLOCK, self.counter)
+        if self.random_next_player:
+            key ^= zobrist_key(PLAYER, type_code(self.current_player.type))
+        return key
+
+    def ready_tasks(self):
+        """The tasks whose predecessors are done that are not started."""
+        return self.availables
+
+    def decision_time(self):
+        """The time the next move is assigned at."""
+        # do_move only returns once a player is idle and a task is ready
+        return self.counter
 
     def update_task_state(self, task):
-        next_tasks = self.current_game_state['f_rel'][task]
-        self.current_game_state['backup'].update(next_tasks)
-        self.current_game_state['done'].add(task)
-        self.current_game_state['backup'] = self.current_game_state['backup'] - self.current_game_state['done'].intersection(self.current_game_state['backup'])
-        if task in self.current_game_state['left']:
-            self.current_game_state['left'].remove(task)
+        """Mark task as done and release the successors whose predecessors
+        are now all done.
+        """
+        task_id = self.task_id[task]
+        self.done |= 1 << task_id
+        self.zobrist ^= zobrist_key(DONE, task_id)
+        if self.required >> task_id & 1:
+            self.n_left -= 1
+        pending = self.pending
+        for next_id in self.succ_idx[self.succ_ptr[task_id]:self.succ_ptr[task_id + 1]]:
+            pending[next_id] -= 1
+            if not pending[next_id]:
+                self.release(self.tasks[next_id])
+
+    def release(self, task):
+        """Called once for every task whose predecessors are all done."""
+        self.availables.append(task)
 
     def do_move(self, task, show_log=False):
-        self.task_his.append(task)
+        """Start task on an idle player, then advance the clock until a
+        player is idle and a task is ready, or the game is over."""
+        self.assigned |= 1 << self.task_id[task]
         if show_log:
             print('#########################################')
             print(self.counter, ' input task: ', task)
             print('available tasks: ', self.availables)
 
-        while True:
-            if self.current_active_players:
-                break
-            else:
-                self.run_step()
-
         if self.start_player_id in self.current_active_players:
             self.current_player = self.players[self.start_player_id]
             self.current_active_players.remove(self.start_player_id)
@@ -102,45 +212,50 @@ class Board:
             self.current_player = self.players[self.current_active_players.pop()]
 
         # assign task to agent
-        self.players[self.current_player.id].assign_task(task, task_duration[task[0]])
+        self.start_task(self.players[self.current_player.id], task)
 
         if task in self.availables:
             self.availables.remove(task)
         end, _ = self.game_end()
         while not end:
-            if self.availables:
+            if self.availables and self.current_active_players:
                 break
-            step_list = []
-            working_players = []
-            for player in self.players:
-                if player.duration > 0:
-                    step_list.append(player.duration)
-                    working_players.append(player.id)
-
-            step = min(step_list)
-            for _ in range(step):
-                self.record[self.counter] = {}
-                for id in working_players:
-                    working_player = self.players[id]
-                    self.record[self.counter][working_player.task] = id
-                self.counter += 1
-            self.check_availability_step(step)
+            self.run_step()
             end, _ = self.game_end()
-        if end:
+        if end and self.record is not None:
             self.check_idle()
 
+    def schedule(self):
+        """Return the (task, player id, start time) of every task started."""
+        return sorted(((task, player_id, start) for task, player_id, start, end in self.record),
+                      key=lambda item: (item[2], item[1]))
+
+    def tick_record(self):
+        """Expand the record into a map from every time step up to now to
+        the {task: player id} of the tasks worked on in it."""
+        ticks = {}
+        for task, player_id, start, end in self.record:
+            for tick in range(start, min(end, self.counter)):
+                ticks.setdefault(tick, {})[task] = player_id
+        return dict(sorted(ticks.items()))
+
     def game_end(self):
-        if not self.current_game_state['left']:
+        if not self.n_left:
             return True, self.counter
         else:
             return False, self.counter
 
+    def idle_time(self, agent_type=None):
+        """Total idle time up to now of the players of agent_type, or of
+        all players. The time of running tasks past now is not counted."""
+        players = [player for player in self.players if agent_type in (None, player.type)]
+        busy = sum(self.busy.get(t, 0) for t in set(player.type for player in players))
+        busy -= sum(player.finish - self.counter for player in players if player.task is not None)
+        return len(players) * self.counter - busy
+
     def check_idle(self):
-        idle = 0
+        idle = self.idle_time()
         player_num = len(self.players)
-        for item in self.record.values():
-            if item:
-                idle += player_num - len(item)
         self.idle['total'] = idle
         self.idle['average_idle'] = idle / player_num
 
@@ -153,38 +268,24 @@ def rollout_policy_fn(board):
 
 
 class MultiPlayerGame:
-    def __init__(self, game_state, player_num, c, round_num):
+    def __init__(self, game_state, player_num, c, round_num, **search_options):
         self.board = None
         self.player_num = player_num
         self.players = []
         self.c = c
         self.round_num = round_num
+        self.search_options = search_options
         self.game_structure = game_state
         self.init_game()
 
     def init_game(self):
         for player_id in range(self.player_num):
-            self.players.append(MTCSPlayer(player_id, 'human', self.c, self.round_num))
+            self.players.append(MTCSPlayer(player_id, 'human', self.c, self.round_num, **self.search_options))
         self.board = Board(self.game_structure, self.players)
 
 
 def load_game_data(xlsx_path, init):
-    df = pd.read_excel(xlsx_path, header=None, dtype=str)
-    forward_dict = {}
-    reverse_dict = {}
-    all_stone = set()
-    for index, row in df.iterrows():
-        forward_dict[row[0]] = set()
-        for r_idx, item in enumerate(row):
-            if not pd.isna(item):
-                all_stone.add(item)
-                if r_idx > 0:
-                        forward_dict[row[0]].add(item)
-                        if item not in reverse_dict.keys():
-                            reverse_dict[item] = set()
-                        reverse_dict[item].add(row[0])
-    game_state = {"f_rel": forward_dict, "b_rel": reverse_dict, 'init': list(init), 'left': all_stone-init}
-    return game_state
+    return load_dag(xlsx_path, init)
 
 
 def parse_args():
@@ -193,61 +294,109 @@ def parse_args():
     parser.add_argument('--player_num', default=8, type=int, help='Number of players of the same type')
     parser.add_argument('--N', default=10, type=int, help='Number of simulations per round N')
     parser.add_argument('--C', default=10, type=int, help='Parameter for balancing utilization and exploration C')
-    parser.add_argument('--scaffold_type', default='2x10', type=str, help='Structure of scaffold')
+    parser.add_argument('--scaffold_type', default='2x10', type=str, help='Structure of scaffold: a registered type, or <stories>x<spans> to generate one')
+    parser.add_argument('--game_workers', default=1, type=int, help='Number of processes the games are spread over')
+    parser.add_argument('--seed', default=0, type=int, help='Seed the per game seeds are derived from')
+    add_search_args(parser)
+    add_budget_args(parser)
+    add_instrument_args(parser)
+    add_results_args(parser)
     return parser.parse_args()
 
 
+def play_game(game_state, config):
+    """Play one game with the settings in config and return its results.
+    A queue in config['moves'] gets every move as it is played, see
+    game_runner.report_move."""
+    t1 = time.perf_counter()
+    start_player = 0
+    wrc_game = MultiPlayerGame(game_state, config['player_num'], config['c'], config['round_num'],
+                               pool=config.get('pool'), **config['search_options'])
+    player = wrc_game.players[start_player]
+    allocator = BudgetAllocator(**config['budget']) if config.get('budget') else None
+    tracer = Tracer(**config['instrument']) if config.get('instrument') else None
+    if tracer is not None:
+        tracer.enable(wrc_game.players)
+    move_time = []
+    limit = 1000
+    for i in range(limit):
+        end, used_time = wrc_game.board.game_end()
+        if end:
+            break
+        sensible_moves = wrc_game.board.availables
+        if len(sensible_moves) > 0:
+            t_move = time.perf_counter()
+            if tracer is not None:
+                tracer.begin()
+            if allocator is None:
+                move = player.mcts.get_move(wrc_game.board)
+            else:
+                move = allocator.get_move(player.mcts, wrc_game.board)
+            move_time.append(time.perf_counter() - t_move)
+            if tracer is not None:
+                tracer.end(wrc_game.board, player.mcts, move, move_time[-1])
+            player.mcts.update_with_move(move)
+            wrc_game.board.do_move(move, False)
+            if config.get('moves') is not None:
+                report_move(config['moves'], wrc_game.board, move_time[-1], player.mcts.last_playouts)
+    board = wrc_game.board
+    return {'makespan': used_time,
+            'time': time.perf_counter() - t1,
+            'idle': dict(board.idle),
+            'utilization': 1 - board.idle['average_idle'] / board.counter,
+            'schedule': board.schedule(),
+            'tt': table_stats(wrc_game.players),
+            'bounds': bound_stats(wrc_game.players),
+            'nodes': node_stats(wrc_game.players),
+            'playouts': sum(player.mcts.total_playouts for player in wrc_game.players),
+            'budget': allocator.log if allocator is not None else None,
+            'move_time': move_time,
+            'trace': tracer.trace() if tracer is not None else None}
+
+
 def run():
     args = parse_args()
     total_game = args.total_game
     player_num = args.player_num
     round_num =args. N
     c = args.C
-    scaffold_type = args.scaffold_type
+    scaffold_type = resolve(args.scaffold_type)
 
     print('player_num: ', player_num)
     print('total_game: ', total_game)
     print('C: ', c, ' round_num: ', round_num)
     print('type: ', scaffold_type)
 
-    start_player = 0
-    total_time, idle_time = [], []
-    computational_time = []
-    agent_utilization = []
-
-    best_used_time = 1e13
-    best_model = None
-
-    for _ in range(total_game):
-        t1 = time.perf_counter()
-        init_state = precedence_graph[scaffold_type][0]
-        GAME_STATE = load_game_data(precedence_graph[scaffold_type][1], init_state)
-
-        wrc_game = MultiPlayerGame(GAME_STATE, player_num, c, round_num)
-        player = wrc_game.players[start_player]
-        limit = 1000
-        for i in range(limit):
-            end, used_time = wrc_game.board.game_end()
-            if end:
-                t2 = time.perf_counter()
-                c_time = t2 - t1
-                computational_time.append(c_time)
-                print('used time: ', c_time)
-                print('cost: ', used_time)
-                total_time.append(used_time)
-                idle_time.append(wrc_game.board.idle['total'])
-                agent_utilization.append(1 - wrc_game.board.idle['average_idle'] / wrc_game.board.counter)
-                print('Agent usage: ', 1 - wrc_game.board.idle['average_idle'] / wrc_game.board.counter)
-                if used_time < best_used_time:
-                    best_used_time = used_time
-                    best_model = copy.deepcopy(wrc_game)
-                break
-            sensible_moves = wrc_game.board.availables
-            if len(sensible_moves) > 0:
-                move = player.mcts.get_move(wrc_game.board)
-                player.mcts.update_with_move(move)
-                wrc_game.board.do_move(move, False)
-
+    # the compiled game state is never modified, so it is shared by all games
+    init_state = precedence_graph[scaffold_type][0]
+    GAME_STATE = load_game_data(precedence_graph[scaffold_type][1], init_state)
+    if args.game_workers > 1 and args.workers > 1:
+        print('WARNING: games run in parallel, searching each move in one process')
+    pool = SearchPool(GAME_STATE, args.workers) if args.workers > 1 and args.game_workers <= 1 else None
+    config = {'player_num': player_num, 'c': c, 'round_num': round_num,
+              'search_options': search_options(args), 'pool': pool, 'budget': budget_options(args),
+              'instrument': instrument_options(args)}
+    # what the games of a result log must share to be resumed
+    record_config = {'mode': 'multi', 'scaffold_type': scaffold_type, 'player_num': player_num, 'c': c,
+                     'round_num': round_num, 'search_options': config['search_options'], 'budget': config['budget'],
+                     'seed': args.seed}
+    log = ResultLog(args.results, record_config) if args.results else None
+    results, records = play_recorded(play_game, GAME_STATE, config, record_config, total_game, args.game_workers,
+                                     args.seed, log)
+
+    if pool is not None:
+        pool.close()
+    if log is not None:
+        log.close()
+    if config['instrument']:
+        print_summary(results)
+        if args.trace:
+            write_trace(args.trace, results)
+    # the best model is the compact record of the shortest game
+    best_model = summarize_games(records)['best']
+    computational_time = [record['time'] for record in records]
+    total_time = [record['makespan'] for record in records]
+    idle_time = [record['idle']['total'] for record in records]
     print(player_num, ' player setting computational time', np.mean(computational_time), ' std: ', np.std(computational_time))
     print(player_num, ' player setting best cost', min(total_time))
     print(player_num, ' average cost', np.mean(total_time), ' std: ', np.std(total_time))
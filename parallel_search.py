@@ -0,0 +1,119 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from operator import itemgetter
+from MTCSPlayer import make_mcts, policy_value_fn, rollout_policy_fn
+from symmetry import task_symmetry
+from macro import MacroPlan
+from game_runner import init_worker, worker_game_state
+
+
+def _search(state, c_puct, n_playout, seed, search_options, time_budget=None):
+    """Grow one tree from state in a worker.
+    Return: its root stats and the number of playouts run
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    state.attach(worker_game_state())
+    mcts = make_mcts(policy_value_fn, c_puct, n_playout, **search_options)
+    n = mcts.search(state, time_budget=time_budget)
+    return mcts.root_stats(), n
+
+
+def merge_root_stats(all_stats):
+    """Merge the root stats of independent trees: visit counts are summed
+    and Q values averaged weighted by visits.
+    Return: a map from action to (n_visits, Q)
+    """
+    merged = {}
+    for stats in all_stats:
+        for action, (n_visits, q) in stats.items():
+            total_visits, total_value = merged.get(action, (0, 0.0))
+            merged[action] = (total_visits + n_visits, total_value + n_visits * q)
+    return {action: (n_visits, total_value / n_visits if n_visits else 0.0)
+            for action, (n_visits, total_value) in merged.items()}
+
+
+class SearchPool(object):
+    """A pool of worker processes for root parallel MCTS.
+    The precedence graph is sent to every worker once, when it starts, and
+    the per move requests only carry the detached board state.
+    """
+
+    def __init__(self, game_state, workers):
+        self.workers = workers
+        self.game_state = game_state
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(game_state,))
+
+    def mcts(self, c_puct, n_playout, **search_options):
+        return RootParallelMCTS(self, c_puct, n_playout, **search_options)
+
+    def __deepcopy__(self, memo):
+        # copies of a game (e.g. the best model) keep using the same pool
+        return self
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class RootParallelMCTS(object):
+    """Root parallel MCTS: the playout budget of a move is split across the
+    workers of a SearchPool, each growing an independent tree from the same
+    root with its own seed. Per action visits and Q values are merged
+    before the move is chosen.
+    """
+
+    def __init__(self, pool, c_puct=5, n_playout=10000, **search_options):
+        self.pool = pool
+        self.c_puct = c_puct
+        self.n_playout = n_playout
+        self.search_options = search_options
+        self.last_stats = {}
+        self.last_playouts = 0
+        self.total_playouts = 0
+        self.plan = MacroPlan()
+
+    def get_move(self, state, n_playout=None, time_budget=None):
+        """The budgets, and early stopping, apply to every worker's tree.
+        With macro moves the workers' root actions are joint assignments,
+        whose tasks are played out one per call like in MCTS.get_move."""
+        macro = self.search_options.get('macro')
+        if macro:
+            move = self.plan.next(state)
+            if move is not None:
+                self.last_playouts = 0
+                return move
+        moves = state.availables
+        if self.search_options.get('symmetry') and len(moves) > 1:
+            moves = task_symmetry(state.current_game_state).firsts(state, moves)
+        if len(moves) == 1:
+            self.last_playouts = 0
+            return next(iter(moves))
+        n_playout = self.n_playout if n_playout is None else n_playout
+        detached = state.detach()
+        workers = max(1, min(self.pool.workers, n_playout))
+        budgets = [n_playout // workers + (i < n_playout % workers) for i in range(workers)]
+        seeds = np.random.randint(2 ** 31, size=workers)
+        futures = [self.pool.executor.submit(_search, detached, self.c_puct, budget, int(seed), self.search_options,
+                                             time_budget)
+                   for budget, seed in zip(budgets, seeds)]
+        results = [future.result() for future in futures]
+        self.last_stats = merge_root_stats([stats for stats, n in results])
+        self.last_playouts = sum(n for stats, n in results)
+        self.total_playouts += self.last_playouts
+        best = max(self.last_stats.items(), key=lambda act_stats: act_stats[1][0])[0]
+        if macro:
+            ranked = sorted(self.last_stats, key=lambda action: -self.last_stats[action][0])
+            return self.plan.start_best(state, ranked) or max(rollout_policy_fn(state), key=itemgetter(1))[0]
+        return best
+
+    def root_stats(self):
+        """The merged root stats of the last move."""
+        return self.last_stats
+
+    def update_with_move(self, last_move, next_player=None):
+        """Trees live in the workers only for the duration of one move."""
+        self.last_stats = {}
+
+    def __str__(self):
+        return "RootParallelMCTS"
@@ -0,0 +1,75 @@
+import json
+import os
+
+
+# the fields of a game result kept in the log, see compact
+RECORD_FIELDS = ('game', 'seed', 'makespan', 'time', 'idle', 'utilization', 'playouts', 'schedule')
+
+
+def add_results_args(parser):
+    parser.add_argument('--results', default=None, type=str,
+                        help='JSON lines file every finished game is appended to; a run with the same settings resumes from it')
+
+
+def compact(result, config):
+    """The record of a finished game: its config, seed, makespan, idle
+    statistics and the schedule as (task, player id, start) tuples."""
+    record = {'config': config}
+    for field in RECORD_FIELDS:
+        record[field] = result.get(field)
+    return record
+
+
+class ResultLog(object):
+    """Append the records of finished games to a JSON lines file, one line
+    per game, flushed as soon as the game is written. Records of earlier
+    runs with the same config are read back by completed, so a killed run
+    can be resumed without playing those games again.
+    """
+
+    def __init__(self, path, config):
+        self.path = path
+        # as read back from the file
+        self.config = json.loads(json.dumps(config))
+        self.file = None
+
+    def completed(self):
+        """Return a map from game index to the record of every game of this
+        config already in the file. A torn last line is ignored.
+        Raises ValueError if the file holds games of another config.
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('config') != self.config:
+                    raise ValueError('%s holds games of other settings: %s' % (self.path, record.get('config')))
+                records[record['game']] = record
+        return records
+
+    def write(self, record):
+        if self.file is None:
+            self._truncate_torn_line()
+            self.file = open(self.path, 'a')
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _truncate_torn_line(self):
+        """Drop a last line a killed run did not finish writing."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
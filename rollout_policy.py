@@ -0,0 +1,128 @@
+import hashlib
+import os
+from itertools import islice
+import numpy as np
+from MTCSPlayer import task_duration
+from dag import compiled_path
+
+
+POLICIES = ['random', 'critical_path', 'successors', 'epsilon']
+# in-process cache of priority tables, see task_priorities
+_priorities = {}
+
+
+def bottom_level(succ_ptr, succ_idx, duration):
+    """Length of the longest path from each task to a sink, counting the
+    task's own duration: the critical path priority."""
+    n = len(duration)
+    level = np.zeros(n, dtype=np.int64)
+    # tasks in reverse topological order, successors first
+    pending = np.diff(succ_ptr).astype(np.int64)
+    pred_ptr, pred_idx = _reverse(succ_ptr, succ_idx, n)
+    stack = [i for i in range(n) if not pending[i]]
+    while stack:
+        i = stack.pop()
+        successors = succ_idx[succ_ptr[i]:succ_ptr[i + 1]]
+        level[i] = duration[i] + (level[successors].max() if len(successors) else 0)
+        for j in pred_idx[pred_ptr[i]:pred_ptr[i + 1]]:
+            pending[j] -= 1
+            if not pending[j]:
+                stack.append(j)
+    return level
+
+
+def _reverse(succ_ptr, succ_idx, n):
+    """CSR predecessor arrays from the CSR successor arrays."""
+    sources = np.repeat(np.arange(n), np.diff(succ_ptr))
+    order = np.argsort(succ_idx, kind='stable')
+    pred_ptr = np.concatenate([[0], np.cumsum(np.bincount(succ_idx, minlength=n))])
+    return pred_ptr, sources[order]
+
+
+def _digest(game_state, duration):
+    h = hashlib.sha1()
+    for array in (game_state['succ_ptr'], game_state['succ_idx'], duration):
+        h.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def priority_path(xlsx_path):
+    """data/dag_2-2.xlsx has its priorities in data/compiled/dag_2-2.priority.npz,
+    a compiled data/compiled/scaffold_3-12.npz in data/compiled/scaffold_3-12.priority.npz"""
+    path = xlsx_path if xlsx_path.endswith('.npz') else compiled_path(xlsx_path)
+    return os.path.splitext(path)[0] + '.priority.npz'
+
+
+def task_priorities(game_state):
+    """Return the per task priority arrays of a game state:
+    'critical_path', the bottom level of the task, and 'successors', its
+    number of direct successors.
+
+    They are computed once per graph and task durations, and cached in
+    priority_path next to the compiled graph if the game state was loaded
+    with dag.load_dag.
+    """
+    duration = np.array([task_duration[task[0]] for task in game_state['tasks']], dtype=np.int64)
+    key = _digest(game_state, duration)
+    if key in _priorities:
+        return _priorities[key]
+    path = priority_path(game_state['path']) if game_state.get('path') else None
+    priorities = _load(path, key) if path else None
+    if priorities is None:
+        priorities = {'critical_path': bottom_level(game_state['succ_ptr'], game_state['succ_idx'], duration),
+                      'successors': np.diff(game_state['succ_ptr']).astype(np.int64)}
+        if path:
+            _save(path, key, priorities)
+    _priorities[key] = priorities
+    return priorities
+
+
+def _load(path, key):
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if str(data['key']) != key:
+                return None
+            return {name: data[name] for name in ('critical_path', 'successors')}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save(path, key, priorities):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, key=key, **priorities)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print('WARNING: could not write priorities', path, e)
+
+
+class RolloutPolicy(object):
+    """Choose the rollout moves by task priority.
+    name: 'random', 'critical_path' (longest path to the end first),
+        'successors' (most successors first) or 'epsilon' (critical path,
+        but a random task with probability epsilon).
+    Ties are broken at random.
+    """
+
+    def __init__(self, game_state, name='random', epsilon=0.1):
+        if name not in POLICIES:
+            raise ValueError('unknown rollout policy %s' % name)
+        self.name = name
+        self.task_id = game_state['task_id']
+        self.epsilon = epsilon if name == 'epsilon' else 0.0
+        if name == 'random':
+            self.priority = None
+        else:
+            table = 'successors' if name == 'successors' else 'critical_path'
+            self.priority = task_priorities(game_state)[table]
+
+    def choose(self, board, rng=np.random):
+        availables = board.availables
+        if self.priority is None or (self.epsilon and rng.random_sample() < self.epsilon):
+            return next(islice(availables, rng.randint(len(availables)), None))
+        keys = self.priority[[self.task_id[task] for task in availables]] + rng.random_sample(len(availables))
+        return next(islice(availables, int(np.argmax(keys)), None))
@@ -0,0 +1,129 @@
+import os
+import re
+import numpy as np
+from dag import compile_dag, save_compiled, load_compiled, source_tasks
+from precedence_graph import precedence_graph
+
+
+# generated graphs are compiled straight to data/compiled/scaffold_<stories>-<spans>.npz
+GENERATED_FOLDER = os.path.join('data', 'compiled')
+# task numbers of a story are offset as if it had at least this many spans,
+# which keeps the names of the hand-authored two story graphs
+MIN_WIDTH = 10
+
+
+def scaffold_dag(stories, spans, baseplate=True):
+    """Return the forward relations of a stories x spans scaffold following
+    the pattern of the data/dag_2-*.xlsx graphs.
+
+    The spans + 1 frames of the first story start from two A and one B per
+    frame, joined by a C per A; every frame then gets its D. Upper stories
+    start from one B per frame, on the H of the story below, followed by the
+    D of the frame. On every story each span has two E, each making two F
+    with the D of one of its frames; the four F of a span are followed by
+    the span's two G, each followed by its H. The E of a span above rest on
+    the H of the span below.
+    baseplate: False leaves out the A, B and C of the first story, whose D
+        then start the graph.
+    """
+    if stories < 1 or spans < 1:
+        raise ValueError('a scaffold needs at least one story and one span')
+    width = max(spans, MIN_WIDTH)
+    forward_dict = {}
+
+    def link(task, next_task):
+        forward_dict.setdefault(task, set()).add(next_task)
+        forward_dict.setdefault(next_task, set())
+
+    for story in range(stories):
+        frame = _numbering(story, width + 1)
+        pair = _numbering(story, 2 * width)
+        below = _numbering(story - 1, 2 * width)
+        for f in range(1, spans + 2):
+            if story > 0:
+                # the B of a frame rests on the H of the span to its left
+                for i in _pair(max(1, f - 1)):
+                    link(below('H', i), frame('B', f))
+                link(frame('B', f), frame('D', f))
+            elif baseplate:
+                for i in _pair(f):
+                    link('A%d' % i, 'C%d' % i)
+                    link('B%d' % f, 'C%d' % i)
+                    link('C%d' % i, frame('D', f))
+            else:
+                forward_dict.setdefault(frame('D', f), set())
+        for span in range(1, spans + 1):
+            for side, f in zip(_pair(span), (span, span + 1)):
+                e = pair('E', side)
+                if story > 0:
+                    for i in _pair(span):
+                        link(below('H', i), e)
+                for k in _pair(side):
+                    task = 'F%d' % (story * 4 * width + k)
+                    link(frame('D', f), task)
+                    link(e, task)
+                    for i in _pair(span):
+                        link(task, pair('G', i))
+            for i in _pair(span):
+                link(pair('G', i), pair('H', i))
+    return forward_dict
+
+
+def _pair(i):
+    """The two task numbers 2i - 1 and 2i that belong to number i."""
+    return 2 * i - 1, 2 * i
+
+
+def _numbering(story, per_story):
+    """Name tasks of story (counted from 0) whose numbers repeat every
+    per_story tasks."""
+    return lambda letter, i: '%s%d' % (letter, story * per_story + i)
+
+
+def scaffold_name(stories, spans, baseplate=True):
+    return '%dx%d%s' % (stories, spans, '' if baseplate else '_no_baseplate')
+
+
+def generated_path(stories, spans, baseplate=True):
+    name = 'scaffold_%d-%d%s.npz' % (stories, spans, '' if baseplate else '-no-baseplate')
+    return os.path.join(GENERATED_FOLDER, name)
+
+
+def register(stories, spans, baseplate=True):
+    """Generate the stories x spans scaffold, compile it and add it to
+    precedence_graph, with the sources of the graph as its init state.
+    Return: its scaffold type, e.g. '3x12'
+    """
+    name = scaffold_name(stories, spans, baseplate)
+    if name in precedence_graph:
+        return name
+    path = generated_path(stories, spans, baseplate)
+    forward_dict = scaffold_dag(stories, spans, baseplate)
+    init = source_tasks(forward_dict)
+    game_state = compile_dag(forward_dict, init)
+    if not _compiled_matches(path, game_state):
+        save_compiled(path, game_state['tasks'], game_state['succ_ptr'], game_state['succ_idx'], init)
+    precedence_graph[name] = [init, path]
+    return name
+
+
+def _compiled_matches(path, game_state):
+    """Whether path already holds the compiled graph of game_state."""
+    try:
+        tasks, succ_ptr, succ_idx, init, source = load_compiled(path)
+    except (OSError, ValueError, KeyError):
+        return False
+    return (tasks == game_state['tasks'] and np.array_equal(succ_ptr, game_state['succ_ptr'])
+            and np.array_equal(succ_idx, game_state['succ_idx']) and sorted(init) == sorted(game_state['init']))
+
+
+def resolve(scaffold_type):
+    """Return scaffold_type after making sure it is in precedence_graph:
+    types like '3x12' or '4x20_no_baseplate' that are not registered yet
+    are generated."""
+    if scaffold_type in precedence_graph:
+        return scaffold_type
+    match = re.match(r'^(\d+)x(\d+)(_no_baseplate)?$', scaffold_type)
+    if match is None:
+        raise ValueError('unknown scaffold type %s, expected <stories>x<spans>' % scaffold_type)
+    return register(int(match.group(1)), int(match.group(2)), match.group(3) is None)
@@ -0,0 +1,444 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multi_tasking_team
+import mixed_team
+from precedence_graph import precedence_graph
+from scaffold import resolve
+from dag import load_dag
+from MTCSPlayer import add_search_args, search_options, make_mcts, policy_value_fn
+from game_runner import game_seeds, play_seeded, summarize_games
+from results import compact
+
+
+# what a planning job may set, and its default
+JOB_DEFAULTS = {'scaffold_type': '2x10', 'mode': 'mixed', 'player_num': 8, 'humanoid_num': 5, 'robot_num': 3,
+                'N': 10, 'C': 10, 'games': 1, 'seed': 0, 'game_playouts': 0, 'game_time': 0,
+                'search_options': {}}
+MAX_BODY = 1 << 16
+# the game states of this worker process by scaffold type, see _load
+_game_states = {}
+
+
+def _load(scaffold_type):
+    if scaffold_type not in _game_states:
+        init, path = precedence_graph[resolve(scaffold_type)]
+        _game_states[scaffold_type] = load_dag(path, init)
+    return _game_states[scaffold_type]
+
+
+def _init_worker(scaffolds):
+    for scaffold_type in scaffolds:
+        _load(scaffold_type)
+
+
+class GameMoves(object):
+    """The moves queue a worker plays a game into. The games share one
+    queue, on which their moves are tagged with the key of the game."""
+
+    def __init__(self, moves, key):
+        self.moves = moves
+        self.key = key
+
+    def put(self, move):
+        self.moves.put((self.key, move))
+
+
+def _play(job, game_index, seed, moves):
+    """Play one game of job in a worker, putting its moves on the moves
+    queue and None once it is over.
+    Return: its record, see results.compact
+    """
+    try:
+        play_game = multi_tasking_team.play_game if job['mode'] == 'multi' else mixed_team.play_game
+        result = play_seeded(play_game, _load(job['scaffold_type']), dict(job['config'], moves=moves), game_index, seed)
+        return compact(result, job['settings'])
+    finally:
+        moves.put(None)
+
+
+def search_defaults():
+    """The search options of the game scripts with their default values,
+    and the parser action of every option."""
+    parser = argparse.ArgumentParser()
+    add_search_args(parser)
+    defaults = search_options(parser.parse_args([]))
+    actions = {}
+    for action in parser._actions:
+        if not action.option_strings or action.dest == 'help':
+            continue
+        # find the option the argument sets by giving it another value
+        if action.nargs == 0:
+            argv = [action.option_strings[0]]
+        elif action.choices:
+            argv = [action.option_strings[0], next(choice for choice in action.choices if choice != action.default)]
+        else:
+            argv = [action.option_strings[0], '7']
+        changed = search_options(parser.parse_args(argv))
+        for option, value in changed.items():
+            if value != defaults[option]:
+                actions[option] = action
+    return defaults, actions
+
+
+def _is_number(value, kind=(int, float)):
+    return isinstance(value, kind) and not isinstance(value, bool)
+
+
+def check_search_options(options, actions):
+    """Raises ValueError for search option values the game scripts would
+    not accept on the command line."""
+    for option, value in options.items():
+        action = actions[option]
+        if action.nargs == 0:
+            valid = isinstance(value, bool)
+        elif action.choices:
+            valid = value in action.choices
+        else:
+            valid = _is_number(value, int if action.type is int else (int, float)) and value >= 0
+        if not valid:
+            raise ValueError('invalid search option %s: %r' % (option, value))
+
+
+def parse_job(request, max_games=0):
+    """Check a planning request and fill in the defaults. The searches of
+    its games are built once, so settings they reject are reported here.
+    max_games: the most games a job may have, 0 for no limit
+    Return: the job, with the play_game config of its games
+    Raises ValueError for an invalid request.
+    """
+    if not isinstance(request, dict):
+        raise ValueError('a job is a JSON object')
+    unknown = set(request) - set(JOB_DEFAULTS)
+    if unknown:
+        raise ValueError('unknown fields: %s' % ', '.join(sorted(unknown)))
+    settings = dict(JOB_DEFAULTS, **request)
+    if not isinstance(settings['search_options'], dict):
+        raise ValueError('search_options is a JSON object')
+    options, actions = search_defaults()
+    unknown = set(settings['search_options']) - set(options)
+    if unknown:
+        raise ValueError('unknown search options: %s' % ', '.join(sorted(unknown)))
+    options.update(settings['search_options'])
+    check_search_options(options, actions)
+    settings['search_options'] = options
+    if settings['mode'] not in ('multi', 'mixed'):
+        raise ValueError('mode is multi or mixed')
+    for field in ('player_num', 'humanoid_num', 'robot_num', 'N', 'games'):
+        if not _is_number(settings[field], int) or settings[field] < 1:
+            raise ValueError('%s must be a positive integer' % field)
+    if max_games and settings['games'] > max_games:
+        raise ValueError('a job has at most %d games' % max_games)
+    for field in ('game_playouts', 'seed'):
+        if not _is_number(settings[field], int) or settings[field] < 0:
+            raise ValueError('%s must be a non-negative integer' % field)
+    if not _is_number(settings['C']) or settings['C'] <= 0:
+        raise ValueError('C must be a positive number')
+    if not _is_number(settings['game_time']) or settings['game_time'] < 0:
+        raise ValueError('game_time must be a non-negative number')
+    if not isinstance(settings['scaffold_type'], str):
+        raise ValueError('scaffold_type is a string')
+    settings['scaffold_type'] = resolve(settings['scaffold_type'])
+    if settings['mode'] == 'mixed':
+        mixed_team.check_constraints(mixed_team.task_constraints, _load(settings['scaffold_type']),
+                                     {'humanoid': settings['humanoid_num'], 'robot': settings['robot_num']})
+    try:
+        make_mcts(policy_value_fn, settings['C'], settings['N'], **options)
+    except (TypeError, ValueError) as e:
+        raise ValueError('invalid search options: %s' % e)
+    budget = None
+    if settings['game_playouts'] or settings['game_time']:
+        budget = {'total_playouts': settings['game_playouts'], 'total_time': settings['game_time']}
+    config = {'c': settings['C'], 'round_num': settings['N'], 'search_options': options, 'budget': budget}
+    if settings['mode'] == 'multi':
+        config['player_num'] = settings['player_num']
+    else:
+        config.update(humanoid_num=settings['humanoid_num'], robot_num=settings['robot_num'])
+    return {'mode': settings['mode'], 'scaffold_type': settings['scaffold_type'], 'settings': settings,
+            'config': config}
+
+
+class Game(object):
+    """A game of a job, waiting in the queue or playing."""
+
+    def __init__(self, job, game_index, seed, moves):
+        self.job = job
+        self.game_index = game_index
+        self.seed = seed
+        self.moves = moves
+        # the moves forwarded from the worker, see PlanningService._forward
+        self.stream = asyncio.Queue()
+        self.future = asyncio.get_running_loop().create_future()
+        self.cancelled = False
+
+
+class PlanningService(object):
+    """Play the games of planning jobs over a process pool whose workers
+    keep the compiled graphs loaded. The games of a job are queued
+    together, first come first served, and workers dispatchers each play
+    one at a time, so no more games run at once than there are workers.
+    A job that does not fit in the queue is refused. Games are not batched
+    into shared executor calls: a call costs well under a millisecond next
+    to the seconds of a game, and a batch would play its games one after
+    another on one worker while the others wait. The workers put the
+    moves of all games on one queue, which a single thread forwards to the
+    event loop. A pool that lost a worker is replaced, failing only the
+    games it was playing.
+    """
+
+    def __init__(self, scaffolds, workers=2, max_queue=64):
+        for scaffold_type in scaffolds:
+            _load(scaffold_type)
+        self.scaffolds = list(scaffolds)
+        self.workers = workers
+        self.executor = self._new_executor()
+        # the moves queue of the workers lives in a manager process
+        self.manager = multiprocessing.Manager()
+        self.moves = self.manager.Queue()
+        # the streaming games by key
+        self.streams = {}
+        self.queue = asyncio.Queue(max_queue)
+        self.running = 0
+        self.job_ids = itertools.count()
+        self.game_keys = itertools.count()
+        self.dispatchers = []
+        self.reader = None
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.scaffolds,))
+
+    def start(self):
+        self.dispatchers = [asyncio.ensure_future(self._dispatch()) for _ in range(self.workers)]
+        self.reader = threading.Thread(target=self._forward, args=(asyncio.get_running_loop(),), daemon=True)
+        self.reader.start()
+
+    def close(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        self.executor.shutdown(cancel_futures=True)
+        if self.reader is not None:
+            self.moves.put((None, None))
+            self.reader.join()
+        self.manager.shutdown()
+
+    def status(self):
+        return {'workers': self.workers, 'running': self.running, 'queued': self.queue.qsize(),
+                'max_queue': self.queue.maxsize, 'scaffolds': self.scaffolds}
+
+    def _forward(self, loop):
+        """Hand the moves of the workers to the event loop, until a None key."""
+        while True:
+            key, move = self.moves.get()
+            if key is None:
+                return
+            loop.call_soon_threadsafe(self._deliver, key, move)
+
+    def _deliver(self, key, move):
+        # the moves of games nobody streams any more are dropped
+        stream = self.streams.get(key)
+        if stream is not None:
+            stream.put_nowait(move)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            game = await self.queue.get()
+            if game.cancelled:
+                continue
+            self.running += 1
+            executor = self.executor
+            try:
+                record = await loop.run_in_executor(executor, _play, game.job, game.game_index, game.seed,
+                                                    game.moves)
+                if not game.cancelled:
+                    game.future.set_result(record)
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool) and executor is self.executor:
+                    # a worker died, e.g. out of memory, and took the pool down
+                    # with the games it was playing; later games get a new one
+                    self.executor = self._new_executor()
+                    executor.shutdown(wait=False)
+                # a worker that died could not end the moves
+                self._deliver(game.moves.key, None)
+                if not game.cancelled:
+                    game.future.set_exception(e)
+            finally:
+                self.running -= 1
+
+    def submit(self, job):
+        """Queue the games of job.
+        Return: its id and its games
+        Raises queue.Full if they do not all fit in the queue.
+        """
+        games = job['settings']['games']
+        if self.queue.maxsize and self.queue.qsize() + games > self.queue.maxsize:
+            raise queue.Full()
+        seeds = game_seeds(job['settings']['seed'], games)
+        job_games = [Game(job, game_index, seed, GameMoves(self.moves, next(self.game_keys)))
+                     for game_index, seed in enumerate(seeds)]
+        for game in job_games:
+            self.streams[game.moves.key] = game.stream
+            self.queue.put_nowait(game)
+        return next(self.job_ids), job_games
+
+    async def events(self, job):
+        """Play job and yield its events: 'queued', then a 'move' per move
+        and a 'game' with the record of every game, in game order, and
+        'done' with the statistics and the best record of the job, or
+        'error' once a game failed. Games still queued when the events are
+        closed early are not played."""
+        job_id, games = self.submit(job)
+        yield {'event': 'queued', 'job': job_id, 'games': len(games), 'queued': self.queue.qsize(),
+               'running': self.running}
+        records = []
+        try:
+            for game in games:
+                async for move in self._moves(game):
+                    move.update(event='move', game=game.game_index)
+                    yield move
+                try:
+                    record = await game.future
+                except Exception as e:
+                    # the rest of the job is not played
+                    yield {'event': 'error', 'job': job_id, 'game': game.game_index, 'error': repr(e)}
+                    return
+                records.append(record)
+                yield dict(record, event='game')
+        finally:
+            for game in games:
+                game.cancelled = True
+                self.streams.pop(game.moves.key, None)
+                if game.future.done():
+                    # nobody waits for the outcome of the games left
+                    game.future.exception()
+        summary = summarize_games(records)
+        yield dict(summary, event='done', job=job_id)
+
+    async def _moves(self, game):
+        """The moves of game as its worker plays them."""
+        while True:
+            move = await game.stream.get()
+            if move is None:
+                return
+            yield move
+
+
+async def _read_request(reader):
+    """Read an HTTP request.
+    Return: its method, path and body
+    """
+    method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+    length = 0
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    if length > MAX_BODY:
+        raise ValueError('request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return method, path, body
+
+
+def _response(writer, status, body):
+    data = json.dumps(body).encode() + b'\n'
+    writer.write(b'HTTP/1.1 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                 % (status.encode(), len(data)) + data)
+
+
+async def _stream(writer, events):
+    """Write events as a chunked stream of JSON lines."""
+    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n'
+                 b'Connection: close\r\n\r\n')
+    async for event in events:
+        data = json.dumps(event).encode() + b'\n'
+        writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+        await writer.drain()
+    writer.write(b'0\r\n\r\n')
+
+
+def handler(service):
+    async def handle(reader, writer):
+        try:
+            try:
+                method, path, body = await _read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                _response(writer, '400 Bad Request', {'error': 'malformed request'})
+                return
+            if method == 'GET' and path == '/status':
+                _response(writer, '200 OK', service.status())
+            elif method == 'POST' and path == '/plan':
+                try:
+                    job = parse_job(json.loads(body or b'{}'), service.queue.maxsize)
+                except ValueError as e:
+                    _response(writer, '400 Bad Request', {'error': str(e)})
+                    return
+                events = service.events(job)
+                try:
+                    first = await events.__anext__()
+                except queue.Full:
+                    _response(writer, '503 Service Unavailable', {'error': 'queue full', **service.status()})
+                    return
+
+                async def all_events():
+                    yield first
+                    async for event in events:
+                        yield event
+                try:
+                    await _stream(writer, all_events())
+                finally:
+                    # a client that went away drops its games still queued
+                    await events.aclose()
+            else:
+                _response(writer, '404 Not Found', {'error': 'GET /status or POST /plan'})
+        except ConnectionError:
+            pass
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+            except ConnectionError:
+                pass
+    return handle
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve planning jobs on localhost')
+    parser.add_argument('--host', default='127.0.0.1', type=str, help='Address to listen on')
+    parser.add_argument('--port', default=8765, type=int, help='Port to listen on')
+    parser.add_argument('--socket', default=None, type=str, help='Unix socket to listen on instead of a port')
+    parser.add_argument('--workers', default=2, type=int, help='Processes the games are played in')
+    parser.add_argument('--max_queue', default=64, type=int, help='Most games waiting to be played, 0 for no limit')
+    parser.add_argument('--scaffolds', nargs='*', default=list(precedence_graph), help='Scaffold types to load up front, others are loaded on first use')
+    return parser.parse_args()
+
+
+async def serve(args):
+    service = PlanningService(args.scaffolds, args.workers, args.max_queue)
+    service.start()
+    if args.socket:
+        server = await asyncio.start_unix_server(handler(service), args.socket)
+        print('serving on', args.socket)
+    else:
+        server = await asyncio.start_server(handler(service), args.host, args.port)
+        print('serving on %s:%d' % (args.host, args.port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
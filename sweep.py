@@ -0,0 +1,162 @@
+import argparse
+import math
+import numpy as np
+import multi_tasking_team
+import mixed_team
+from precedence_graph import precedence_graph
+from scaffold import resolve
+from dag import load_dag
+from MTCSPlayer import add_search_args, search_options
+from parallel_search import SearchPool
+from game_runner import GamePool, game_seeds
+from budget import add_budget_args, budget_options
+
+
+# two sided 95% quantiles of Student's t for 1 to 30 degrees of freedom
+T_975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def confidence_interval(values):
+    """Return the mean of values and the half width of its 95% confidence
+    interval, inf for a single value."""
+    mean = float(np.mean(values))
+    n = len(values)
+    if n < 2:
+        return mean, float('inf')
+    t = T_975[n - 2] if n - 1 <= len(T_975) else 1.96
+    return mean, t * float(np.std(values, ddof=1)) / math.sqrt(n)
+
+
+def parse_range(text):
+    """'2:5' is 2, 3, 4 and 5, '2,4,8' is 2, 4 and 8."""
+    values = []
+    for part in text.split(','):
+        if ':' in part:
+            low, high = part.split(':')
+            values.extend(range(int(low), int(high) + 1))
+        else:
+            values.append(int(part))
+    return sorted(set(values))
+
+
+class Candidate(object):
+    """A team composition in the race and the results of its games."""
+
+    def __init__(self, team, config):
+        self.team = team
+        self.config = config
+        self.results = []
+        # the round it was eliminated in, None while it is still racing
+        self.out = None
+
+    def name(self):
+        if len(self.team) == 1:
+            return '%d' % self.team
+        return '%dH-%dR' % self.team
+
+    def makespan(self):
+        return float(np.mean([result['makespan'] for result in self.results]))
+
+
+def successive_halving(candidates, game_pool, play_game, games=2, eta=2, rounds=0, seed=0):
+    """Race candidates with successive halving: in round k every candidate
+    still racing plays up to games * eta ** k games in all, then only the
+    best 1 / eta of them by mean makespan keep racing. Game i of every
+    candidate has the same seed, so they are compared on the same draws.
+    rounds: the number of rounds, by default enough to leave one candidate
+    """
+    if not rounds:
+        # the rounds that leave one candidate, who need not play any more
+        rounds, left = 0, len(candidates)
+        while left > 1:
+            left = -(-left // eta)
+            rounds += 1
+        rounds = max(1, rounds)
+    seeds = game_seeds(seed, games * eta ** (rounds - 1))
+    racing = list(candidates)
+    for k in range(rounds):
+        target = games * eta ** k
+        batch = [(candidate, i) for candidate in racing for i in range(len(candidate.results), target)]
+        print('round %d: %d compositions, %d games each' % (k, len(racing), target))
+        for position, result in game_pool.play(play_game, [(candidate.config, i, seeds[i]) for candidate, i in batch]):
+            batch[position][0].results.append(result)
+        racing.sort(key=Candidate.makespan)
+        keep = -(-len(racing) // eta)
+        for candidate in racing[keep:]:
+            candidate.out = k
+        racing = racing[:keep]
+        if len(racing) == 1:
+            break
+    return sorted(candidates, key=lambda candidate: (candidate.out is not None, -(candidate.out or 0),
+                                                     candidate.makespan()))
+
+
+def print_table(ranked):
+    print('%4s %10s %6s %19s %6s %19s %5s' % ('rank', 'team', 'games', 'makespan (95% CI)', 'best', 'utilization', 'out'))
+    for rank, candidate in enumerate(ranked, 1):
+        makespan, makespan_ci = confidence_interval([result['makespan'] for result in candidate.results])
+        utilization, utilization_ci = confidence_interval([result['utilization'] for result in candidate.results])
+        print('%4d %10s %6d %9.1f +- %-6.1f %6d %9.3f +- %-6.3f %5s'
+              % (rank, candidate.name(), len(candidate.results), makespan, makespan_ci,
+                 min(result['makespan'] for result in candidate.results), utilization, utilization_ci,
+                 '-' if candidate.out is None else candidate.out))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Race team compositions with successive halving')
+    parser.add_argument('--mode', default='mixed', choices=['multi', 'mixed'], help='Game mode of the teams')
+    parser.add_argument('--player_num', default='2:8', type=str, help='Players of the multi mode, e.g. 2:8 or 3,5,8')
+    parser.add_argument('--humanoid_num', default='1:5', type=str, help='Humanoid robots of the mixed mode, e.g. 1:5')
+    parser.add_argument('--robot_num', default='1:3', type=str, help='Transportation robots of the mixed mode, e.g. 1:3')
+    parser.add_argument('--games', default=2, type=int, help='Games per composition in the first round')
+    parser.add_argument('--eta', default=2, type=int, help='Each round keeps 1/eta of the compositions and plays eta times the games')
+    parser.add_argument('--rounds', default=0, type=int, help='Number of rounds, 0 until one composition is left')
+    parser.add_argument('--N', default=10, type=int, help='Number of simulations per round N')
+    parser.add_argument('--C', default=10, type=int, help='Parameter for balancing utilization and exploration C')
+    parser.add_argument('--scaffold_type', default='2x10', type=str, help='Structure of scaffold: a registered type, or <stories>x<spans> to generate one')
+    parser.add_argument('--game_workers', default=1, type=int, help='Number of processes the games are spread over')
+    parser.add_argument('--seed', default=0, type=int, help='Seed the per game seeds are derived from')
+    add_search_args(parser)
+    add_budget_args(parser)
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    if args.eta < 2:
+        raise ValueError('eta must be at least 2')
+    scaffold_type = resolve(args.scaffold_type)
+    init_state, path = precedence_graph[scaffold_type]
+    game_state = load_dag(path, init_state)
+    if args.game_workers > 1 and args.workers > 1:
+        print('WARNING: games run in parallel, searching each move in one process')
+    # one search pool and one game pool for all compositions
+    search_pool = SearchPool(game_state, args.workers) if args.workers > 1 and args.game_workers <= 1 else None
+    game_pool = GamePool(game_state, args.game_workers)
+    config = {'c': args.C, 'round_num': args.N, 'search_options': search_options(args), 'pool': search_pool,
+              'budget': budget_options(args)}
+    if args.mode == 'multi':
+        play_game = multi_tasking_team.play_game
+        candidates = [Candidate((n,), dict(config, player_num=n)) for n in parse_range(args.player_num) if n > 0]
+    else:
+        play_game = mixed_team.play_game
+        # every task type needs an agent that can take it
+        candidates = [Candidate((h, r), dict(config, humanoid_num=h, robot_num=r))
+                      for h in parse_range(args.humanoid_num) for r in parse_range(args.robot_num) if h > 0 and r > 0]
+    if not candidates:
+        raise ValueError('no team composition to race')
+    print('type: ', scaffold_type, ' compositions: ', len(candidates))
+    try:
+        ranked = successive_halving(candidates, game_pool, play_game, args.games, args.eta, args.rounds, args.seed)
+    finally:
+        game_pool.close()
+        if search_pool is not None:
+            search_pool.close()
+    print_table(ranked)
+    return ranked
+
+
+if __name__ == '__main__':
+    ranked = run()
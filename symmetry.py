@@ -0,0 +1,261 @@
+import hashlib
+import os
+import numpy as np
+from batch_rollout import bits_to_mask
+from transposition import type_code
+from dag import compiled_path
+
+
+# in-process cache of the task classes of a graph, see task_symmetry
+_symmetries = {}
+
+
+def refine(copies, pred, succ):
+    """Color refinement of one or more colorings of the graph at once:
+    every task's color is split by the colors of its predecessors and
+    successors until no color splits any more. Colors are renumbered the
+    same way in every copy, so tasks of different copies with the same
+    color can still be mapped onto each other.
+    Return: the refined copies, or None if they stopped sharing colors
+    """
+    n_colors = len(set(copies[0]))
+    while True:
+        signatures = [[(colors[i], tuple(sorted(colors[j] for j in pred[i])),
+                        tuple(sorted(colors[j] for j in succ[i]))) for i in range(len(colors))]
+                      for colors in copies]
+        if any(sorted(other) != sorted(signatures[0]) for other in signatures[1:]):
+            return None
+        table = {signature: color for color, signature in enumerate(sorted(set(signatures[0])))}
+        copies = [[table[signature] for signature in copy] for copy in signatures]
+        if len(table) == n_colors:
+            return copies
+        n_colors = len(table)
+
+
+def automorphism(pred, succ, edges, colors, a, b):
+    """Find an automorphism of the graph that keeps colors and maps task a
+    to task b by individualization and refinement.
+    Return: the image of every task, or None if there is none
+    """
+    ca, cb = list(colors), list(colors)
+    ca[a] = cb[b] = max(colors) + 1
+    return _search(ca, cb, pred, succ, edges)
+
+
+def _search(ca, cb, pred, succ, edges):
+    refined = refine([ca, cb], pred, succ)
+    if refined is None:
+        return None
+    ca, cb = refined
+    # most tasks are usually left where they are, try that first
+    image = _closest(ca, cb)
+    if all((image[u], image[v]) in edges for u, v in edges):
+        return image
+    cells = {}
+    for i, color in enumerate(ca):
+        cells.setdefault(color, []).append(i)
+    cell = min((cell for cell in cells.values() if len(cell) > 1), key=len, default=None)
+    if cell is None:
+        return None
+    # map the first task of the smallest cell onto each candidate in turn
+    i = cell[0]
+    fresh = len(cells)
+    for j in [j for j, color in enumerate(cb) if color == ca[i]]:
+        ca_j, cb_j = list(ca), list(cb)
+        ca_j[i] = cb_j[j] = fresh
+        image = _search(ca_j, cb_j, pred, succ, edges)
+        if image is not None:
+            return image
+    return None
+
+
+def _closest(ca, cb):
+    """Map every task with the same color in both copies to itself and
+    the others in order onto the tasks of their color."""
+    image = [i if ca[i] == cb[i] else None for i in range(len(ca))]
+    left = {}
+    for j, color in enumerate(cb):
+        if ca[j] != color:
+            left.setdefault(color, []).append(j)
+    for i, color in enumerate(ca):
+        if image[i] is None:
+            image[i] = left[color].pop(0)
+    return image
+
+
+def find_classes(game_state):
+    """Find the classes of interchangeable tasks of a graph, see TaskSymmetry.
+    Return: the class of every task, -1 for a task alone in its class, and
+    a map from the tasks in a class to the image of every task under an
+    automorphism mapping the first task of the class onto them
+    """
+    tasks = game_state['tasks']
+    succ_ptr, succ_idx = game_state['succ_ptr'], game_state['succ_idx']
+    n = len(tasks)
+    succ = [[int(j) for j in succ_idx[succ_ptr[i]:succ_ptr[i + 1]]] for i in range(n)]
+    pred = [[] for _ in range(n)]
+    for i in range(n):
+        for j in succ[i]:
+            pred[j].append(i)
+    edges = set((i, j) for i in range(n) for j in succ[i])
+    labels = [(task[0], bool(required)) for task, required in zip(tasks, game_state['required'])]
+    table = {label: color for color, label in enumerate(sorted(set(labels)))}
+    colors = refine([[table[label] for label in labels]], pred, succ)[0]
+    cells = {}
+    for i, color in enumerate(colors):
+        cells.setdefault(color, []).append(i)
+    cls = [-1] * n
+    maps = {}
+    for color, cell in cells.items():
+        if len(cell) < 2:
+            continue
+        first = cell[0]
+        for member in cell:
+            if member == first:
+                image = list(range(n))
+            else:
+                image = automorphism(pred, succ, edges, colors, first, member)
+                if image is None:
+                    continue
+            cls[member] = color
+            maps[member] = np.array(image)
+    return cls, maps
+
+
+class TaskSymmetry(object):
+    """Classes of interchangeable tasks of a precedence graph.
+
+    Tasks are in the same class if an automorphism of the graph maps one
+    onto the other, keeping task types and which tasks are required. For
+    every class, maps[m] is one such automorphism from the first task of
+    the class to its member m. Two ready tasks a and b of a class can be
+    swapped in a state if maps[b] after the inverse of maps[a] leaves the
+    state as it is: every task has the same status as its image, done,
+    running until the same time on the same agent type, or neither. The
+    games after starting either one are then the same up to the names of
+    the tasks, so a search only needs to try one of them.
+    """
+
+    def __init__(self, game_state, classes=None):
+        """classes: the cls and maps of the graph found before, see
+        find_classes, which are found again if None"""
+        self.n = len(game_state['tasks'])
+        self.task_id = game_state['task_id']
+        # class of every task, -1 for tasks no other task can stand for
+        self.cls, self.maps = classes if classes is not None else find_classes(game_state)
+        self.inverse = {member: np.argsort(image) for member, image in self.maps.items()}
+        self.n_classes = len(set(self.cls) - {-1}) + self.cls.count(-1)
+
+    def status(self, state):
+        """The status of every task of state: -1 if done, a code of its
+        finish time and agent type if running, 0 otherwise."""
+        code = np.zeros(self.n, dtype=np.int64)
+        code[bits_to_mask(state.done, self.n)] = -1
+        for player in state.players:
+            if player.task is not None:
+                code[self.task_id[player.task]] = (player.finish << 32) + type_code(player.type) + 1
+        return code
+
+    def swaps(self, a, b, code):
+        """Whether ready tasks a and b can be swapped in the state of code."""
+        image = self.maps[b][self.inverse[a]]
+        return np.array_equal(code[image], code)
+
+    def representatives(self, state, tasks):
+        """Map every one of tasks, ready tasks of state, to the first of
+        them it can be swapped with."""
+        cls = self.cls
+        task_id = self.task_id
+        code = None
+        firsts = {}
+        represent = {}
+        for task in tasks:
+            i = task_id[task]
+            if cls[i] < 0:
+                represent[task] = task
+                continue
+            for first in firsts.setdefault(cls[i], []):
+                if code is None:
+                    code = self.status(state)
+                if self.swaps(task_id[first], i, code):
+                    represent[task] = first
+                    break
+            else:
+                firsts[cls[i]].append(task)
+                represent[task] = task
+        return represent
+
+    def firsts(self, state, tasks):
+        """The tasks no earlier one of tasks can be swapped with."""
+        return list(dict.fromkeys(self.representatives(state, tasks).values()))
+
+    def reduce(self, state, action_probs):
+        """Merge the (task, prior) pairs of the tasks that can be swapped
+        into one pair of the first task, with the sum of their priors."""
+        action_probs = list(action_probs)
+        represent = self.representatives(state, [action for action, prob in action_probs])
+        merged = {}
+        for action, prob in action_probs:
+            first = represent[action]
+            merged[first] = merged.get(first, 0.0) + prob
+        return list(merged.items())
+
+
+def _digest(game_state):
+    h = hashlib.sha1()
+    h.update(''.join(task[0] for task in game_state['tasks']).encode())
+    for array in (game_state['succ_ptr'], game_state['succ_idx'], game_state['required']):
+        h.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def symmetry_path(xlsx_path):
+    """data/dag_2-2.xlsx has its task classes in data/compiled/dag_2-2.symmetry.npz,
+    a compiled data/compiled/scaffold_3-12.npz in data/compiled/scaffold_3-12.symmetry.npz"""
+    path = xlsx_path if xlsx_path.endswith('.npz') else compiled_path(xlsx_path)
+    return os.path.splitext(path)[0] + '.symmetry.npz'
+
+
+def task_symmetry(game_state):
+    """Return the TaskSymmetry of a game state.
+
+    Its classes are found once per graph, and cached in symmetry_path next
+    to the compiled graph if the game state was loaded with dag.load_dag.
+    """
+    key = _digest(game_state)
+    if key in _symmetries:
+        return _symmetries[key]
+    path = symmetry_path(game_state['path']) if game_state.get('path') else None
+    classes = _load(path, key) if path else None
+    symmetry = TaskSymmetry(game_state, classes)
+    if classes is None and path:
+        _save(path, key, symmetry)
+    _symmetries[key] = symmetry
+    return symmetry
+
+
+def _load(path, key):
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if str(data['key']) != key:
+                return None
+            members = data['members'].tolist()
+            return data['cls'].tolist(), dict(zip(members, data['maps'].astype(np.int64)))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save(path, key, symmetry):
+    members = sorted(symmetry.maps)
+    maps = np.array([symmetry.maps[member] for member in members], dtype=np.int32).reshape(len(members), symmetry.n)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, key=key, cls=np.array(symmetry.cls, dtype=np.int64),
+                                members=np.array(members, dtype=np.int64), maps=maps)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print('WARNING: could not write task classes', path, e)
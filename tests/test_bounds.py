@@ -0,0 +1,41 @@
+import random
+import pytest
+import multi_tasking_team
+import mixed_team
+from bounds import LowerBound
+from precedence_graph import precedence_graph
+from dag import load_dag
+
+
+def new_board(game_state, mode, team):
+    if mode == 'multi':
+        return multi_tasking_team.MultiPlayerGame(game_state, team[0], 10, 1).board
+    board = mixed_team.WRCGame(game_state, team[0], team[1], 10, 1).board
+    board.set_current_player(team[0])
+    return board
+
+
+def random_game(board, lower_bound):
+    """Play board out with random moves.
+    Return: the bounds of every state on the way and the makespan
+    """
+    bounds = []
+    while not board.game_end()[0]:
+        bounds.append((lower_bound.critical_path(board), lower_bound.resource(board), lower_bound(board)))
+        board.do_move(random.choice(list(board.availables)))
+    return bounds, board.game_end()[1]
+
+
+@pytest.mark.parametrize('scaffold_type', ['2x2', '2x4'])
+@pytest.mark.parametrize('mode, team', [('multi', (1,)), ('multi', (3,)), ('multi', (8,)),
+                                        ('mixed', (1, 1)), ('mixed', (2, 1)), ('mixed', (5, 3))])
+def test_lower_bound_never_exceeds_the_makespan(scaffold_type, mode, team):
+    init, path = precedence_graph[scaffold_type]
+    game_state = load_dag(path, init)
+    lower_bound = LowerBound(game_state)
+    random.seed(0)
+    for _ in range(10):
+        bounds, makespan = random_game(new_board(game_state, mode, team), lower_bound)
+        assert bounds
+        for critical_path, resource, bound in bounds:
+            assert max(critical_path, resource) == bound <= makespan
@@ -0,0 +1,61 @@
+import random
+import numpy as np
+import pytest
+import multi_tasking_team
+import mixed_team
+from MTCSPlayer import MCTS, policy_value_fn, task_duration
+from precedence_graph import precedence_graph
+from dag import load_dag
+
+
+@pytest.fixture(scope='module')
+def game_state():
+    init_state, path = precedence_graph['2x2']
+    return load_dag(path, init_state)
+
+
+def play(play_game, game_state, config):
+    random.seed(0)
+    np.random.seed(0)
+    return play_game(game_state, dict({'c': 10, 'search_options': {}}, **config))
+
+
+def check_schedule(game_state, result):
+    """Every required task is played once, after its predecessors, and no
+    player works on two tasks at once."""
+    start = {}
+    player_tasks = {}
+    for task, player_id, time in result['schedule']:
+        assert task not in start
+        start[task] = time
+        player_tasks.setdefault(player_id, []).append((time, time + task_duration[task[0]]))
+    assert set(game_state['left']) <= set(start)
+    for task, time in start.items():
+        for pred in game_state['b_rel'].get(task, ()):
+            assert start[pred] + task_duration[pred[0]] <= time
+    for intervals in player_tasks.values():
+        intervals.sort()
+        for (_, end), (begin, _) in zip(intervals, intervals[1:]):
+            assert end <= begin
+    assert result['makespan'] == max(start[task] + task_duration[task[0]] for task in game_state['left'])
+
+
+def test_one_playout_moves_by_prior(game_state):
+    board = multi_tasking_team.MultiPlayerGame(game_state, 2, 10, 1).board
+    mcts = MCTS(policy_value_fn, 10, 1)
+    assert mcts.search(board) == 1
+    # the root has its priors but no child nodes yet
+    assert mcts.root.priors and not mcts.root.children
+    assert mcts.get_move(board, 1) in board.availables
+    assert set(mcts.root_stats()) == set(mcts.root.priors)
+
+
+@pytest.mark.parametrize('play_game, team', [(multi_tasking_team.play_game, {'player_num': 2}),
+                                             (mixed_team.play_game, {'humanoid_num': 2, 'robot_num': 1})])
+@pytest.mark.parametrize('config', [{'round_num': 1},
+                                    {'round_num': 10, 'budget': {'total_playouts': 3, 'total_time': 0}},
+                                    {'round_num': 10, 'budget': {'total_playouts': 0, 'total_time': 0.05}},
+                                    {'round_num': 10, 'search_options': {'macro': 4, 'early_stop': True}}])
+def test_games_with_one_playout_per_move(game_state, play_game, team, config):
+    result = play(play_game, game_state, dict(config, **team))
+    check_schedule(game_state, result)
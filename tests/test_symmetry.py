@@ -0,0 +1,70 @@
+import random
+import pytest
+import multi_tasking_team
+import mixed_team
+from symmetry import task_symmetry
+from precedence_graph import precedence_graph
+from dag import load_dag
+
+
+def new_board(game_state, mode, team):
+    if mode == 'multi':
+        return multi_tasking_team.MultiPlayerGame(game_state, team[0], 10, 1).board
+    board = mixed_team.WRCGame(game_state, team[0], team[1], 10, 1).board
+    board.set_current_player(team[0])
+    return board
+
+
+def coupled_makespans(board, a, b, image, seed):
+    """Start a on one clone of board and b on another, then play the first
+    out at random and the second with the image of every move.
+    Return: the makespans of both
+    """
+    tasks = board.tasks
+    task_id = board.task_id
+    first, second = board.clone(), board.clone()
+    random.seed(seed)
+    first.do_move(a)
+    random.seed(seed)
+    second.do_move(b)
+    rng = random.Random(seed)
+    while not first.game_end()[0]:
+        assert set(tasks[image[task_id[task]]] for task in first.availables) == set(second.availables)
+        move = rng.choice(list(first.availables))
+        # the next player drawn in mixed games is the same in both
+        state = random.getstate()
+        first.do_move(move)
+        random.setstate(state)
+        second.do_move(tasks[image[task_id[move]]])
+    assert second.game_end()[0]
+    return first.game_end()[1], second.game_end()[1]
+
+
+@pytest.mark.parametrize('scaffold_type', ['2x2', '2x4'])
+@pytest.mark.parametrize('mode, team', [('multi', (2,)), ('multi', (5,)), ('mixed', (2, 1)), ('mixed', (3, 2))])
+def test_merged_tasks_have_equal_makespans(scaffold_type, mode, team):
+    """Games after tasks that reduce merges are the same up to the names of
+    the tasks, so played out with the same moves up to those names they
+    end at the same time: the makespan distributions are equal."""
+    init, path = precedence_graph[scaffold_type]
+    game_state = load_dag(path, init)
+    symmetry = task_symmetry(game_state)
+    random.seed(0)
+    merges = 0
+    board = new_board(game_state, mode, team)
+    while not board.game_end()[0]:
+        moves = list(board.availables)
+        reduced = dict(symmetry.reduce(board, [(task, 1.0) for task in moves]))
+        assert sum(reduced.values()) == len(moves)
+        represent = symmetry.representatives(board, moves)
+        for task, first in represent.items():
+            if task == first:
+                continue
+            assert task not in reduced and first in reduced
+            a, b = board.task_id[first], board.task_id[task]
+            image = symmetry.maps[b][symmetry.inverse[a]]
+            makespans = coupled_makespans(board, first, task, image, merges)
+            assert makespans[0] == makespans[1]
+            merges += 1
+        board.do_move(random.choice(moves))
+    assert merges
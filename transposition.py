@@ -0,0 +1,64 @@
+from collections import OrderedDict
+import zlib
+
+
+MASK = (1 << 64) - 1
+
+# kinds of zobrist keys, mixed into every key
+DONE, RUNNING, CLOCK, PLAYER = 1, 2, 3, 4
+
+_type_codes = {}
+
+
+def _mix(x):
+    """splitmix64 finalizer"""
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK
+    return x ^ (x >> 31)
+
+
+def type_code(agent_type):
+    if agent_type not in _type_codes:
+        _type_codes[agent_type] = zlib.crc32(agent_type.encode())
+    return _type_codes[agent_type]
+
+
+def zobrist_key(kind, *values):
+    """A pseudo random 64 bit key for a state feature, e.g.
+    zobrist_key(RUNNING, task_id, finish_time, type_code(agent_type)).
+    Keys are derived by hashing, so no table has to be kept per DAG.
+    """
+    h = _mix(kind * 0x9E3779B97F4A7C15 & MASK)
+    for value in values:
+        h = _mix(h ^ (value & MASK))
+    return h
+
+
+class TranspositionTable(object):
+    """A bounded map from state hash to search node, evicting the least
+    recently used entry when full. Evicted nodes stay in the tree, they are
+    just no longer shared with newly reached equivalent states.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.nodes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key, node):
+        """Return the node stored for key, storing node (and setting its
+        key attribute) if there is none."""
+        shared = self.nodes.get(key)
+        if shared is not None:
+            self.hits += 1
+            self.nodes.move_to_end(key)
+            return shared
+        self.misses += 1
+        node.key = key
+        self.nodes[key] = node
+        if len(self.nodes) > self.max_size:
+            self.nodes.popitem(last=False)
+            self.evictions += 1
+        return node